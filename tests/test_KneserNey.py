@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from toiledemots.ngrams import nGrams
+from toiledemots.KneserNey import LanguageModel
+
+WORDS = (u"le la un une chat chien souris oiseau dort mange court chante vole petit grand "
+         u"noir blanc gris vite lentement ici dans jardin maison arbre").split()
+
+# rare words, so that every order has n-grams seen once or twice
+RARE = [u"mot%i" % i for i in range(100)]
+
+def _word(rand):
+    return rand.choice(RARE) if rand.random() < 0.2 else rand.choice(WORDS)
+
+def _sentences(rand, n=150):
+    return [u" ".join(_word(rand) for i in range(rand.randint(1, 8))) for j in range(n)]
+
+class TestCompile(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def queries(self, max_arity, n=200):
+        return [tuple(_word(self.random) if self.random.random() < 0.95 else u"inconnu" for i in range(self.random.randint(1, max_arity)))
+                for j in range(n)]
+
+    def assertSameP(self, ngrams, interpolate):
+        lm = LanguageModel(ngrams, interpolate=interpolate)
+        compiled = LanguageModel(ngrams, interpolate=interpolate)
+        compiled.compile()
+
+        for ngram in self.queries(ngrams.get_max_arity()):
+            self.assertAlmostEqual(compiled.p(ngram), lm.p(ngram), 12, (ngram, interpolate))
+
+    def test_compiled(self):
+        for max_arity in (2, 3, 4):
+            ngrams = nGrams(max_arity)
+            ngrams.build(_sentences(self.random))
+
+            for interpolate in (True, False):
+                self.assertSameP(ngrams, interpolate)
+
+    def test_update(self):
+        ngrams = nGrams(3)
+        ngrams.build(_sentences(self.random))
+        compiled = LanguageModel(ngrams)
+        compiled.compile()
+        queries = self.queries(3)
+        for ngram in queries:
+            compiled.p(ngram)
+
+        ngrams.update(_sentences(self.random, 50))
+        lm = LanguageModel(ngrams)
+        for ngram in queries:
+            self.assertAlmostEqual(compiled.p(ngram), lm.p(ngram), 12, ngram)
+
+        compiled.compile()
+        for ngram in queries:
+            self.assertAlmostEqual(compiled.p(ngram), lm.p(ngram), 12, ngram)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from toiledemots.cache import Cache
+
+class TestCache(unittest.TestCase):
+    def test_lru(self):
+        cache = Cache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+        self.assertEqual(sorted(cache), ["a", "c"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_setdefault(self):
+        cache = Cache(2)
+        for i in range(10):
+            self.assertEqual(cache.setdefault(i, i*2), i*2)
+            self.assertLessEqual(len(cache), 2)
+
+        self.assertEqual(cache.setdefault(8, None), 16)
+        cache[10] = 20
+        self.assertEqual(sorted(cache.items()), [(8, 16), (10, 20)])
+
+    def test_popitem(self):
+        cache = Cache(3, max_bytes=1000, sizeof=len)
+        cache["a"] = "x"*10
+        cache["b"] = "y"*20
+        self.assertEqual(cache.popitem(), ("a", "x"*10))
+        self.assertEqual(cache.nbytes, 20)
+
+        for i in range(10):
+            cache[i] = "z"
+        self.assertEqual(sorted(cache), [7, 8, 9])
+
+        for i in range(3):
+            cache.popitem()
+        self.assertRaises(KeyError, cache.popitem)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_copy(self):
+        cache = Cache(3)
+        cache.update(a=1, b=2, c=3)
+        cache.get("a")
+
+        copy = cache.copy()
+        self.assertIsInstance(copy, Cache)
+        self.assertEqual(dict(copy), dict(cache))
+        copy["d"] = 4
+        self.assertEqual(sorted(copy), ["a", "c", "d"])
+        self.assertEqual(sorted(cache), ["a", "b", "c"])
+
+    def test_fromkeys(self):
+        cache = Cache.fromkeys(range(5), 0, max=3)
+        self.assertIsInstance(cache, Cache)
+        self.assertEqual(sorted(cache), [2, 3, 4])
+        self.assertEqual(len(Cache.fromkeys("abc")), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from toiledemots import ngrams as ng
+from toiledemots.ngrams import nGrams
+
+WORDS = (u"le la un une chat chien souris oiseau dort mange court chante vole petit grand "
+         u"noir blanc gris vite lentement ici dans jardin maison arbre").split()
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(0)
+        rare = [u"mot%i" % i for i in range(2000)]
+        self.lines = [u" ".join(rand.choice(rare) if rand.random() < 0.2 else rand.choice(WORDS)
+                                for i in range(rand.randint(1, 10))) for j in range(3000)]
+
+        # many chunks, so that they are merged at several levels
+        self.chunk_lines = ng.CHUNK_LINES
+        ng.CHUNK_LINES = 170
+
+    def tearDown(self):
+        ng.CHUNK_LINES = self.chunk_lines
+
+    def assertSameNGrams(self, ngrams, expected):
+        self.assertEqual(ngrams.get_vocabulary().words(), expected.get_vocabulary().words())
+        for order in range(1, expected.get_max_arity()+1):
+            self.assertEqual(list(ngrams.table(order).items()), list(expected.table(order).items()))
+
+    def test_parallel(self):
+        serial = nGrams(3)
+        serial.build(self.lines)
+
+        for options in [{}, {"max_memory": 2**16}]:
+            parallel = nGrams(3)
+            parallel.build(self.lines, workers=2, **options)
+            self.assertSameNGrams(parallel, serial)
+
+    def test_parallel_update(self):
+        serial = nGrams(3)
+        serial.build(self.lines[:1000])
+        serial.build(self.lines[1000:])
+
+        parallel = nGrams(3)
+        parallel.build(self.lines[:1000], workers=2)
+        parallel.build(self.lines[1000:], workers=3)
+        self.assertSameNGrams(parallel, serial)
+
+if __name__ == "__main__":
+    unittest.main()
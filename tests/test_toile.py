@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from toiledemots.toile import distance, distances, voyelles
+
+def _reference_distance(string1, string2):
+    """
+        The original enumeration of the common substrings of every padding,
+        exponential in the difference of length, distance is checked against
+    """
+    points = 0
+
+    if len(string1) < len(string2):
+        return max(_reference_distance(" "+string1, string2), _reference_distance(string1+" ", string2))
+    elif len(string1) > len(string2):
+        return max(_reference_distance(string1, " "+string2), _reference_distance(string1, string2+" "))
+
+    for i in range(len(string1)+1):
+        for j in range(i+1, len(string1)+1):
+            if string1[i:j] == string2[i:j]:
+                if all(letter in voyelles for letter in string1[i:j]):
+                    points += 2
+                else:
+                    points += 1
+
+    return points
+
+class TestDistance(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def random_word(self, letters="aeioubnrst ", max_length=8):
+        return "".join(self.random.choice(letters) for i in range(self.random.randint(0, max_length)))
+
+    def test_example(self):
+        self.assertEqual(distance("bonjour", "honneur"), _reference_distance("bonjour", "honneur"))
+
+    def test_random_pairs(self):
+        for i in range(2000):
+            word1, word2 = self.random_word(), self.random_word()
+            self.assertEqual(distance(word1, word2), _reference_distance(word1, word2), (word1, word2))
+
+    def test_symmetric(self):
+        for i in range(500):
+            word1, word2 = self.random_word(), self.random_word()
+            self.assertEqual(distance(word1, word2), distance(word2, word1), (word1, word2))
+
+    def test_distances(self):
+        for i in range(200):
+            word = self.random_word()
+            candidats = [self.random_word() for j in range(10)]
+            self.assertEqual(distances(word, candidats),
+                             [_reference_distance(word, candidat) for candidat in candidats], (word, candidats))
+
+if __name__ == "__main__":
+    unittest.main()
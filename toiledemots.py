@@ -1,17 +1,67 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
 
 from toiledemots import pipe
 from toiledemots.toile import Toile
 
 def main():
     lines = pipe.fetch_text_lines("data/train.fr")
-    print lines[0], lines[-1]
+    print(lines[0], lines[-1])
     toile = Toile(min_count=0)
     toile.build(lines[:10000])
     
-    closests = toile.get_closests(u"ciel")
+    closests = toile.get_closests(u"ciel", 20)
+
+    print(closests[:20])
+
+def serve(argv):
+    """
+        toiledemots.py serve --model model.bin --arity 4 --toile toile.bin --socket /tmp/toiledemots.sock
+    """
+    from toiledemots import server
+    from toiledemots.ngrams import nGrams
+    from toiledemots.shards import ShardedNGrams
+    from toiledemots.KneserNey import LanguageModel
+
+    parser = argparse.ArgumentParser(prog="toiledemots.py serve",
+                                     description="Answers p, score, perplexity and closests queries")
+    parser.add_argument("--model",help="the n-grams of the language model, a file or the directory of write_shards")
+    parser.add_argument("--arity",type=int,default=3,help="the maximal arity of the n-grams")
+    parser.add_argument("--min-count",type=int,default=0,help="the minimal count of the n-grams")
+    parser.add_argument("--no-compile",action="store_true",help="don't precompute the Kneser-Ney statistics")
+    parser.add_argument("--toile",help="a Toile saved by Toile.save")
+    parser.add_argument("--socket",help="the Unix socket to listen to")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=server.DEFAULT_PORT)
+    parser.add_argument("--workers",type=int,help="the processes searching the closest words")
+    args = parser.parse_args(argv)
+
+    lm = None
+    if args.model and os.path.isdir(args.model):
+        # the sharded models are not compiled (see ShardedNGrams)
+        lm = LanguageModel(ShardedNGrams(args.model))
+    elif args.model:
+        ngrams = nGrams(args.arity,args.min_count)
+        ngrams.load(args.model)
+        lm = LanguageModel(ngrams)
+        if not args.no_compile:
+            lm.compile()
+
+    toile = None
+    if args.toile:
+        toile = Toile()
+        toile.load(args.toile)
 
-    print closests[:20]
+    server.serve(lm,toile,args.socket,args.host,args.port,workers=args.workers)
 
 if __name__ == "__main__":
-   main() 
+    if sys.argv[1:2] == ["serve"]:
+        serve(sys.argv[2:])
+    elif sys.argv[1:2] == ["benchmark"]:
+        from toiledemots import benchmark
+        sys.exit(benchmark.main(sys.argv[2:]))
+    else:
+        main()
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import time
-import ngrams as ng
-from timer import Timer, seconds_to_string
-import sys
+from . import ngrams as ng
+import math
+import itertools
+from array import array
+from .tokenizer import Tokenizer
+from .cache import Cache
+from .metrics import get_metrics
+
+def _log10(p):
+    if p > 0:
+        return math.log10(p)
+    return float('-inf')
+
+# number of sentences scored together by score_sentences
+BATCH_SENTENCES = 1000
+
+# number of probabilities of n-grams kept by a model
+CACHE_SIZE = 2**16
 
 class LanguageModel(object):
     """
@@ -21,18 +36,172 @@ class LanguageModel(object):
             The number of unique N-grams that match a given pattern. ``(*)'' represents a wildcard matching a single word. 
         n1,n[1]
             The number of unique N-grams with count = 1. 
+
+        compile() precomputes these statistics for every n-gram so that p()
+        only looks them up. They are dropped whenever the version of the
+        n-grams changes (build, update, merge, prune, set_minimal_count, ...),
+        the model must then be compiled again to look them up.
+
+        The probabilities of the n-grams and of their suffixes are kept in a
+        cache of cache_size items keyed by the ids of their words, emptied by
+        compile and clear_cache, and whenever the version of the n-grams
+        changes (build, update, merge, prune, load, ... renumber the ids).
+
+        The calls of p and logp are counted as lm.p and lm.logp, compile and
+        the batches of score_sentences are timed as the phases lm.compile and
+        lm.score of metrics (default metrics.get_metrics()) and the cache is
+        watched as lm.cache.
     """
 
-    def __init__(self,ngrams,alpha=3,modified=False,interpolate=True):
+    def __init__(self,ngrams,alpha=3,modified=False,interpolate=True,metrics=None,cache_size=CACHE_SIZE):
         self.ngrams = ngrams
         self.alpha = alpha
         self.interpolate = interpolate
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.__compiled = False
+        # (keys of the n-gram, higher) -> p, see __keys, for the version
+        # of the n-grams
+        self.__cache = Cache(cache_size)
+        self.__version = ngrams.version
+        self.metrics.watch("lm.cache",self.__cache)
+
+    def uncompile(self):
+        """
+            Drops the statistics of compile, p computes them from the n-grams
+        """
+        self.__compiled = False
+        self.__discounts = self.__follow = self.__follow_sum = None
+        self.__continuation = self.__middle = self.__context = None
+        self.__bows = self.__bowls = None
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+            Empties the cache of the probabilities
+        """
+        self.__cache.clear()
+        self.__version = self.ngrams.version
+
+    def compile(self):
+        """
+            Computes, in one pass per order:
+
+                D[n]: the discount of the n-grams
+                follow[n][a_]: n(a_*), the number of (n+1)-grams beginning with a_
+                follow_sum[n][a_]: c(a_*), the sum of the counts of these (n+1)-grams
+                continuation[n][_z]: n(*_z), the number of (n+1)-grams ending with _z
+                middle[n][_]: n(*_*), the number of (n+2)-grams with _ in the middle
+                bow[n][a_]: bow(a_) and bowl[n][_]: bow(_)
+
+            Every statistic of an n-gram is stored in an array at the row of the
+            n-gram in the table of its order (see nGrams.row).
+
+            Examples:
+
+                lm = LanguageModel(ngrams)
+                lm.compile()
+                lm.p((u"un",u"test"))
+        """
+        with self.metrics.phase("lm.compile"):
+            self.__compile()
+
+        self.clear_cache()
+
+    def __compile(self):
+        ngrams = self.ngrams
+        max_arity = ngrams.get_max_arity()
+        min_count = ngrams.get_minimal_count()
+
+        def filtered(count):
+            if count >= min_count:
+                return count
+            return 0
+
+        self.__discounts = {}
+        for order in range(1,max_arity+1):
+            n1, n2 = ngrams.n(order,1), ngrams.n(order,2)
+
+            try:
+                self.__discounts[order] = n1 / (0.+ (n1+2*n2))
+            except ZeroDivisionError as e:
+                self.__discounts[order] = 0.0
+
+        # the statistics kept by nGrams.prune if the n-grams were pruned
+        statistics = ngrams.continuation_statistics()
+
+        self.__follow = {}
+        self.__follow_sum = {}
+        self.__continuation = {}
+        self.__middle = {}
+        self.__context = {}
+
+        for order in range(1,max_arity):
+            self.__follow[order] = statistics['follow'][order-1]
+            self.__follow_sum[order] = statistics['follow_sum'][order-1]
+            self.__continuation[order] = statistics['continuation'][order-1]
+
+            if order+2 <= max_arity:
+                self.__middle[order] = statistics['middle'][order-1]
+
+            table = ngrams.table(order)
+            upper = ngrams.table(order+1)
+            context = array('l',[-1])*len(upper)
+
+            lo = 0
+            for row in range(len(table)):
+                i,j = upper.search(table.key(row),0,lo)
+                lo = j
+                for upper_row in range(i,j):
+                    context[upper_row] = row
+
+            self.__context[order+1] = context
+
+        self.__bows = {}
+        self.__bowls = {}
+        for order in range(1,max_arity):
+            table = ngrams.table(order)
+            D = self.__discounts[order]
+            follow = self.__follow[order]
+
+            bows = array('d')
+            for row in range(len(table)):
+                if filtered(table.counts[row]) == 0:
+                    bows.append(0.0)
+                    continue
+
+                if order == 1:
+                    # c(w*) of a 1-gram is c(w), see nGrams.csum
+                    csum = filtered(table.counts[row])
+                elif self.__context[order][row] >= 0:
+                    csum = self.__follow_sum[order-1][self.__context[order][row]]
+                else:
+                    csum = self.__csum(ngrams.get_vocabulary().decode(table.key(row)))
+
+                try:
+                    bows.append(D*follow[row] / (.0+ csum))
+                except ZeroDivisionError as e:
+                    bows.append(0.0)
+
+            self.__bows[order] = bows
+
+            if order in self.__middle:
+                middle = self.__middle[order]
+                bowls = array('d')
+                for row in range(len(table)):
+                    if middle[row] > 0:
+                        bowls.append(D*follow[row] / (.0+ middle[row]))
+                    else:
+                        bowls.append(0.0)
+
+                self.__bowls[order] = bowls
+
+        self.__compiled = True
 
     def __nc(self,n,c):
         """
             n1,n[1] The number of unique N-grams with count = 1. 
         """
-        return len(self.ngrams.grams_with_count(n,c))
+        return self.ngrams.n(n,c)
 
     def __c(self,ngram):
         """
@@ -53,10 +222,31 @@ class LanguageModel(object):
         """
         return self.ngrams.lencontains(ngram,(wildcards[0],wildcards[1]*-1))#len(self.ngrams.contains(ngram,(wildcards[0],wildcards[1]*-1)))
 
+    def __compiled_csum(self,ngram):
+        """
+            c(a_*) from the compiled statistics, None if a_ is not an n-gram
+        """
+        if len(ngram) == 1:
+            return None
+
+        row = self.ngrams.row(ngram[:-1])
+        if row < 0:
+            return None
+
+        return self.__follow_sum[len(ngram)-1][row]
+
     def __f(self,ngram):
         """
             f(a_z) = (c(a_z) - D0) / c(a_) ;; for highest order N-grams
         """
+        if self.__compiled:
+            csum = self.__compiled_csum(ngram)
+            if csum is not None:
+                try:
+                    return (self.__c(ngram)-self.__D(ngram))/(.0+csum)
+                except ZeroDivisionError as e:
+                    return 0.0
+
         try:
             return (self.__c(ngram)-self.__D(ngram))/(.0+self.__csum(ngram))
         except ZeroDivisionError as e:
@@ -78,6 +268,12 @@ class LanguageModel(object):
         """
             g(a_z) = max(0, c(a_z) - D) / c(a_*)
         """
+        if self.__compiled and self.__c(ngram[:-1])>0:
+            try:
+                return max(0,self.__c(ngram) - self.__D(ngram)) / (.0+ self.__compiled_csum(ngram))
+            except ZeroDivisionError as e:
+                return 0.0
+
         if self.__c(ngram[:-1])>0:
             try:
                 return max(0,self.__c(ngram) - self.__D(ngram)) / (.0+ self.__csum(ngram))
@@ -90,6 +286,20 @@ class LanguageModel(object):
         """
             gl(_z)  = max(0, n(*_z) - D) / n(*_*)
         """
+        if self.__compiled and len(ngram)-1 in self.__middle:
+            row = self.ngrams.row(ngram[:-1])
+            if row >= 0:
+                middle = self.__middle[len(ngram)-1][row]
+                if middle > 0:
+                    row = self.ngrams.row(ngram)
+                    continuation = self.__continuation[len(ngram)][row] if row >= 0 else 0
+                    try:
+                        return max(0,continuation-self.__D(ngram)) / (.0+ middle)
+                    except ZeroDivisionError as e:
+                        return 0.0
+                else:
+                    return 0.0
+
         e_ngram = tuple([""]+list(ngram))
         if self.__n(e_ngram,(1,1))>0:
             try:
@@ -103,6 +313,12 @@ class LanguageModel(object):
         """
             bow(a_) = D n(a_*) / c(a_*)
         """
+        if self.__compiled and len(ngram) in self.__bows:
+            row = self.ngrams.row(ngram)
+            if row < 0:
+                return 0.0
+            return self.__bows[len(ngram)][row]
+
         e_ngram = tuple(list(ngram)+[""])
         if self.__c(ngram)>0:
             try:
@@ -116,6 +332,11 @@ class LanguageModel(object):
         """
             bow(_)  = D n(_*) / n(*_*)
         """
+        if self.__compiled and len(ngram) in self.__bowls:
+            row = self.ngrams.row(ngram)
+            if row >= 0:
+                return self.__bowls[len(ngram)][row]
+
         if self.__n(tuple([""]+list(ngram)+[""]),(1,1))>0:
             try:
                 return self.__D(ngram)*self.__n(tuple(list(ngram)+[""]),(0,1)) / (.0+ self.__n(tuple([""]+list(ngram)+[""]),(1,1)))
@@ -128,6 +349,9 @@ class LanguageModel(object):
         """
             D = n1 / (n1+2*n2)
         """
+        if self.__compiled:
+            return self.__discounts[len(ngram)]
+
         n1 = self.__nc(len(ngram),1)
         try:
             return n1 / (0.+ (n1+2*self.__nc(len(ngram),2)))
@@ -150,19 +374,101 @@ class LanguageModel(object):
     def p(self,ngram,higher=True):
         """
             p(a_z) = g(a_z) + bow(a_)p(_z) ; Eqn.4
+
+            An n-gram longer than get_max_arity() is scored as the product of
+            the probabilities of its windows of get_max_arity() words.
         """
-        if len(ngram)>self.ngrams.get_max_arity():
-            return self.p(ngram[len(ngram)-self.ngrams.get_max_arity():])*self.p(ngram[:-1])
+        self.metrics.count("lm.p")
+
+        max_arity = self.ngrams.get_max_arity()
+        if len(ngram)<=max_arity:
+            return self.__chain(ngram,higher)
+
+        p = self.__chain(ngram[:max_arity])
+        for end in range(max_arity+1,len(ngram)+1):
+            p = self.__chain(ngram[end-max_arity:end])*p
+
+        return p
+
+    def logp(self,ngram,higher=True):
+        """
+            Returns:
+
+                log10 p(a_z), -inf if p(a_z) is 0. score_sentences and
+                perplexity use this base too.
+
+            The probabilities of the windows of an n-gram longer than
+            get_max_arity() are summed in log space, so that a long n-gram
+            does not underflow to 0 like with p.
+
+            Examples:
+
+                lm.logp((u"un",u"test"))
+                lm.logp(tuple(u"une très longue phrase de plusieurs mots".split()))
+        """
+        self.metrics.count("lm.logp")
+
+        max_arity = self.ngrams.get_max_arity()
+        if len(ngram)<=max_arity:
+            return _log10(self.__chain(ngram,higher))
+
+        logp = _log10(self.__chain(ngram[:max_arity]))
+        for end in range(max_arity+1,len(ngram)+1):
+            logp += _log10(self.__chain(ngram[end-max_arity:end]))
+
+        return logp
+
+    def __keys(self,ngram):
+        """
+            Returns:
+
+                the ids of the words of ngram, a word which is not in the
+                vocabulary being kept as is
+        """
+        vocabulary = self.ngrams.get_vocabulary()
+        return tuple([vocabulary.get(word,word) for word in ngram])
+
+    def __chain(self,ngram,higher=True):
+        """
+            p(a_z) of an n-gram of at most get_max_arity() words, from the
+            longest suffix of a_z in the cache up to a_z
+
+            Every suffix is computed once from the probability of the next
+            one (p(_z) for p(a_z)) and kept in the cache.
+        """
+        if self.ngrams.version != self.__version:
+            # the rows of the compiled statistics are the ones of the old tables
+            self.uncompile()
+
+        keys = self.__keys(ngram)
+        cache = self.__cache
+
+        # the suffixes are all computed with higher, only a_z uses the argument
+        start = len(ngram)
+        p = None
+        for i in range(len(ngram)):
+            p = cache.get((keys[i:],higher or i>0))
+            if p is not None:
+                start = i
+                break
+
+        for i in range(start-1,-1,-1):
+            p = self.__level(ngram[i:],higher or i>0,p)
+            cache[(keys[i:],higher or i>0)] = p
+
+        return p
+
+    def __level(self,ngram,higher,p):
+        """
+            p(a_z) from p = p(_z)
+        """
+        if len(ngram)==1:
+            return self.ngrams.freq(ngram)
 
         if len(ngram)==2 and self.ngrams.get_max_arity()>2:
             gl = self.__gl(ngram)
             bowl = self.__bowl(ngram[:-1])
-            p = self.p(ngram[1:],higher=False)
             return gl+bowl*p
-        if len(ngram)==1:
-            return self.ngrams.freq(ngram)
-
-        nt = len(ngram)
 
         g = self.__g(ngram)
 
@@ -171,7 +477,7 @@ class LanguageModel(object):
         else:
             mult = self.__bowl(ngram[:-1])
 
-        mult = mult * self.p(ngram[1:],higher=True)
+        mult = mult * p
 
         if self.interpolate and higher:
             p = g+mult
@@ -185,53 +491,139 @@ class LanguageModel(object):
             p = mult
 
         return p
+
+    def score_sentences(self,sentences,tokenizer=None,batch_size=BATCH_SENTENCES):
+        """
+            Arguments:
+
+                sentences: the sentences to score, any iterable of unicode lines
+                    (a list, a generator from pipe, ...). It is read only once.
+                tokenizer: the Tokenizer splitting the lines in words
+                    (default Tokenizer(), like nGrams.build)
+                batch_size: the number of sentences scored together (default 1000)
+
+            Returns:
+
+                a generator over an array of the log10 probabilities of the
+                words of every sentence (see logp), -inf for a word of
+                probability 0
+
+            A sentence is padded with n-1 empty words like in nGrams.build and
+            every word is scored with logp on the window of the n-1 words
+            before it (n = get_max_arity()). The windows repeated in a batch
+            are scored only once.
+
+            Examples:
+
+                for scores in lm.score_sentences(pipe.iter_text_lines("data/test.fr")):
+                    print(sum(scores))
+        """
+        if tokenizer is None:
+            tokenizer = Tokenizer()
+
+        max_arity = self.ngrams.get_max_arity()
+        padding = (u"",)*(max_arity-1)
+
+        sentences = iter(sentences)
+        while True:
+            batch = list(itertools.islice(sentences,batch_size))
+            if not batch:
+                return
+
+            start = time.time()
+            windows = []
+            for words in tokenizer.tokenize_batch(batch):
+                padded = padding + tuple(words)
+                windows.append([padded[i:i+max_arity] for i in range(len(words))])
+
+            scores = {}
+            for window in itertools.chain(*windows):
+                if window not in scores:
+                    scores[window] = self.logp(window)
+
+            self.metrics.record("lm.score",time.time()-start,sentences=len(batch),windows=len(scores))
+
+            for sentence in windows:
+                yield array('d',[scores[window] for window in sentence])
+
+    def perplexity(self,sentences,tokenizer=None,batch_size=BATCH_SENTENCES):
+        """
+            Arguments:
+
+                sentences: the sentences of the test set, any iterable of unicode lines
+                tokenizer: the Tokenizer splitting the lines in words (default Tokenizer())
+                batch_size: the number of sentences scored together (default 1000)
+
+            Returns:
+
+                the perplexity of the words of the sentences, 10**(-sum(log10 p)/n)
+                with the log10 probabilities of score_sentences, inf if a word
+                has probability 0 and 0.0 if there is no word
+
+            Examples:
+
+                lm.perplexity(pipe.iter_text_lines("data/test.fr"))
+        """
+        total, n = 0.0, 0
+        for scores in self.score_sentences(sentences,tokenizer,batch_size):
+            total += sum(scores)
+            n += len(scores)
+
+        try:
+            return 10**(-total/n)
+        except ZeroDivisionError as e:
+            return 0.0
         
 if __name__ == "__main__":
     ngram = ng.nGrams(3)
     ngram.build([u"C'est un test bien simple", u"Ça ne fait pas beaucoup de mots"])
     ngram.print_list()
     lm = LanguageModel(ngram,alpha=2)
-    print "C'est un test bien simple"
-    print "Ça ne fait pas beaucoup de mots"
-    print "un : ",lm.p((u'un',))
-    print "anticonstitutionnellement : ",lm.p((u'anticonstitutionnellement',))
-    print "un anticonstitutionnellement : ",lm.p((u'un',u'anticonstitutionnellement',))
-    print "un test : ",lm.p((u'un',u'test'))
-    print "un test coucou : ",lm.p((u'un',u'test',u'coucou'))
-    print "un coucou test : ",lm.p((u'un',u'coucou',u'test'))
+    lm.compile()
+    print("C'est un test bien simple")
+    print("Ça ne fait pas beaucoup de mots")
+    print("un : ",lm.p((u'un',)))
+    print("anticonstitutionnellement : ",lm.p((u'anticonstitutionnellement',)))
+    print("un anticonstitutionnellement : ",lm.p((u'un',u'anticonstitutionnellement',)))
+    print("un test : ",lm.p((u'un',u'test')))
+    print("un test coucou : ",lm.p((u'un',u'test',u'coucou')))
+    print("un coucou test : ",lm.p((u'un',u'coucou',u'test')))
+    print("log10 un test coucou : ",lm.logp((u'un',u'test',u'coucou')))
+    for scores in lm.score_sentences([u"C'est un test",u"Ça ne fait pas de mots"]):
+        print("scores : ",list(scores))
+    print("perplexity : ",lm.perplexity([u"C'est un test bien simple"]))
 
     ngram = ng.nGrams(4)
     ngram.load('../data/french')
     lm = LanguageModel(ngram,alpha=2,interpolate=False)
     lmi = LanguageModel(ngram,alpha=2)
     start = time.time()
-    print "est un quiqwe  : ",lmi.p((u'est',u'un',u'quiqwe'))
-    print "It tooks ",time.time()-start,"s"
+    print("est un quiqwe  : ",lmi.p((u'est',u'un',u'quiqwe')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "est un quiqwe  : ",lmi.p((u'est',u'un',u'quiqwe'))
-    print "It tooks ",time.time()-start,"s"
+    print("est un quiqwe  : ",lmi.p((u'est',u'un',u'quiqwe')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "est un zimbabwéen  : ",lmi.p((u'est',u'un',u'zimbabwéen'))
-    print "It tooks ",time.time()-start,"s"
+    print("est un zimbabwéen  : ",lmi.p((u'est',u'un',u'zimbabwéen')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "est un président  : ",lmi.p((u'est',u'un',u'président'))
-    print "It tooks ",time.time()-start,"s"
+    print("est un président  : ",lmi.p((u'est',u'un',u'président')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "ceci est un  : ",lmi.p((u'ceci',u'est',u'un'))
-    print "It tooks ",time.time()-start,"s"
+    print("ceci est un  : ",lmi.p((u'ceci',u'est',u'un')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "Voici une phrase plutôt simple",lmi.p((u'Voici',u'une',u'phrase',u'plutôt',u'simple'))
-    print "It tooks ",time.time()-start,"s"
+    print("Voici une phrase plutôt simple",lmi.p((u'Voici',u'une',u'phrase',u'plutôt',u'simple')))
+    print("It tooks ",time.time()-start,"s")
     start = time.time()
-    print "Phrase formé mal avec qwetrqq inconnu mot",lmi.p((u'Phrase',u'formé',u'mal',u'avec',u'qwetrqq',u'inconnu',u'mot'))
-    print "It tooks ",time.time()-start,"s"
+    print("Phrase formé mal avec qwetrqq inconnu mot",lmi.p((u'Phrase',u'formé',u'mal',u'avec',u'qwetrqq',u'inconnu',u'mot')))
+    print("It tooks ",time.time()-start,"s")
 
 #    sys.exit(0)
 
     tmps = 0
     tmpss = 0
-    t = Timer(ngram.len(2))
-    t.start()
+    progress = lmi.metrics.progress("lm.sums",ngram.len(2))
     # need 3-grams for this
     for i, ng in enumerate(ngram.getgrams(2)):
         tmps = 0
@@ -239,10 +631,8 @@ if __name__ == "__main__":
             tmps += lmi.p(nng)
 
         tmpss += tmps
-        update = t.update(1)
-        if update:
-            sys.stderr.write("time remaining : "+seconds_to_string(update)+"\n")
-        print i,tmpss
-        print "tmp %i : %f" % (i,tmpss/(0.+i+1))
+        progress.update(1)
+        print(i,tmpss)
+        print("tmp %i : %f" % (i,tmpss/(0.+i+1)))
 
-    print "final : ",tmpss/(0.+ngram.len(2))
+    print("final : ",tmpss/(0.+ngram.len(2)))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+    n-grams, Kneser-Ney language models and closest words
+
+    The classes are imported from their modules when first accessed (see
+    __getattr__), so importing the package alone does not load them.
+
+    Examples:
+
+        import toiledemots
+
+        ngrams = toiledemots.nGrams(3)
+        lm = toiledemots.LanguageModel(ngrams)
+"""
+
+import importlib
+
+__all__ = ['nGrams', 'LanguageModel', 'Toile', 'Tokenizer', 'Vocabulary', 'NGramTable',
+           'Cache', 'ShardedNGrams', 'write_shards', 'Metrics', 'get_metrics', 'set_metrics']
+
+# the module of every exported name
+_EXPORTS = {
+    'nGrams': 'ngrams',
+    'LanguageModel': 'KneserNey',
+    'Toile': 'toile',
+    'Tokenizer': 'tokenizer',
+    'Vocabulary': 'vocabulary',
+    'NGramTable': 'table',
+    'Cache': 'cache',
+    'ShardedNGrams': 'shards',
+    'write_shards': 'shards',
+    'Metrics': 'metrics',
+    'get_metrics': 'metrics',
+    'set_metrics': 'metrics',
+}
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
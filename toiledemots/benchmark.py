@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from .ngrams import nGrams
+from .KneserNey import LanguageModel
+from .toile import Toile
+
+__all__ = ['synthetic_corpus', 'run', 'compare']
+
+LETTERS = u"bcdfghjlmnpqrstvz"
+VOWELS = u"aeiouéèy"
+
+def synthetic_corpus(n_lines,n_words=5000,seed=0):
+    """
+        Arguments:
+
+            n_lines: the number of lines
+            n_words: the size of the vocabulary (default 5000)
+            seed: the seed of the random generator (default 0)
+
+        Returns:
+
+            a list of n_lines random lines, the same for the same arguments
+
+        The words are made of syllables and drawn with a Zipf distribution,
+        the lines have from 1 to 20 words and some punctuation.
+
+        Examples:
+
+            lines = synthetic_corpus(10000)
+    """
+    generator = random.Random(seed)
+
+    words = set()
+    while len(words) < n_words:
+        syllables = generator.randint(1,4)
+        words.add(u"".join(generator.choice(LETTERS)+generator.choice(VOWELS) for i in range(syllables)))
+    words = sorted(words)
+    generator.shuffle(words)
+
+    # Zipf: the weight of the word of rank r is 1/r
+    cumulative = []
+    total = 0.
+    for rank in range(1,n_words+1):
+        total += 1./rank
+        cumulative.append(total)
+
+    def word():
+        x = generator.random()*total
+        lo, hi = 0, n_words-1
+        while lo < hi:
+            mid = (lo+hi)//2
+            if cumulative[mid] < x:
+                lo = mid+1
+            else:
+                hi = mid
+        return words[lo]
+
+    lines = []
+    for i in range(n_lines):
+        line = u" ".join(word() for j in range(generator.randint(1,20)))
+        lines.append(line+generator.choice([u"",u".",u" ?",u", "+word()+u"."]))
+
+    return lines
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies)-1,int(p*len(latencies)))]*1e6
+
+    return {"p50_us":percentile(0.50),"p90_us":percentile(0.90),"p99_us":percentile(0.99),
+            "mean_us":sum(latencies)/len(latencies)*1e6,"n":len(latencies)}
+
+def _latencies(function,arguments):
+    latencies = []
+    for argument in arguments:
+        start = time.time()
+        function(*argument)
+        latencies.append(time.time()-start)
+
+    return _percentiles(latencies)
+
+def _timed(function,*arguments):
+    start = time.time()
+    result = function(*arguments)
+    return time.time()-start, result
+
+def _peak_rss():
+    """
+        Returns the peak resident memory of the process in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS
+    if sys.platform == "darwin":
+        return peak
+    return peak*1024
+
+def _commit():
+    try:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=directory,
+                                       stderr=open(os.devnull,'w')).decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run(n_lines=20000,arity=3,n_words=5000,n_queries=2000,seed=0):
+    """
+        Arguments:
+
+            n_lines: the number of lines of the synthetic corpus (default 20000)
+            arity: the maximal arity of the n-grams (default 3)
+            n_words: the size of the vocabulary of the corpus (default 5000)
+            n_queries: the number of queries of every latency (default 2000)
+            seed: the seed of the corpus and of the queries (default 0)
+
+        Returns:
+
+            a dictionnary of the measures, see main
+
+        Examples:
+
+            results = run(n_lines=1000)
+    """
+    generator = random.Random(seed)
+    lines = synthetic_corpus(n_lines,n_words,seed)
+    n_tokens = sum(len(line.split()) for line in lines)
+
+    results = {"parameters":{"n_lines":n_lines,"arity":arity,"n_words":n_words,
+                             "n_queries":n_queries,"seed":seed,"n_tokens":n_tokens},
+               "environment":{"python":platform.python_version(),"platform":platform.platform(),
+                              "commit":_commit(),"date":time.strftime("%Y-%m-%dT%H:%M:%S")}}
+
+    # build
+    ngrams = nGrams(arity)
+    seconds, _ = _timed(ngrams.build,lines)
+    results["build"] = {"seconds":seconds,"lines_per_s":n_lines/seconds,"n_grams":len(ngrams)}
+
+    # save and load
+    directory = tempfile.mkdtemp(prefix="toiledemots-benchmark-")
+    model = os.path.join(directory,"model.bin")
+    try:
+        seconds, _ = _timed(ngrams.save,model)
+        results["save"] = {"seconds":seconds,"bytes":os.path.getsize(model)}
+
+        for use_mmap in (True,False):
+            loaded = nGrams(arity)
+            seconds, _ = _timed(loaded.load,model,use_mmap)
+            results["load_mmap" if use_mmap else "load"] = {"seconds":seconds}
+    finally:
+        os.remove(model)
+        os.rmdir(directory)
+
+    # lookups, every query once so that the caches don't answer them
+    grams = [ngrams.getgrams(order) for order in range(1,arity+1)]
+    queries = []
+    for i in range(n_queries):
+        order = generator.randint(2,arity) if arity > 1 else 1
+        queries.append(generator.choice(grams[order-1]))
+
+    wildcards = [(0,-1),(1,0)] if arity > 1 else [(0,0)]
+    results["contains"] = _latencies(ngrams.contains,[(ngram,wildcards[i%len(wildcards)])
+                                                      for i, ngram in enumerate(queries)])
+    results["csum"] = _latencies(ngrams.csum,[(len(ngram),ngram,(0,-1)) for ngram in queries])
+
+    # language model, on n-grams of the corpus and on new ones
+    new_lines = synthetic_corpus(max(1,n_queries//10),n_words,seed+1)
+    tokens = [line.split() for line in new_lines]
+    windows = []
+    for i in range(n_queries):
+        words = generator.choice(tokens)
+        start = generator.randint(0,max(0,len(words)-arity))
+        windows.append(tuple(words[start:start+arity]))
+
+    lm = LanguageModel(ngrams)
+    seconds, _ = _timed(lambda: [lm.p(window) for window in windows])
+    results["p"] = {"seconds":seconds,"queries_per_s":len(windows)/seconds}
+
+    lm = LanguageModel(ngrams)
+    seconds, _ = _timed(lm.compile)
+    results["compile"] = {"seconds":seconds}
+    seconds, _ = _timed(lambda: [lm.p(window) for window in windows])
+    results["p_compiled"] = {"seconds":seconds,"queries_per_s":len(windows)/seconds}
+
+    # on lines of the corpus, the new ones may have unknown words (an infinite perplexity)
+    known_lines = lines[:len(new_lines)]
+    n_known = sum(len(line.split()) for line in known_lines)
+    seconds, perplexity = _timed(lm.perplexity,known_lines)
+    results["perplexity"] = {"seconds":seconds,"words_per_s":n_known/seconds,"perplexity":perplexity}
+
+    # toile
+    toile = Toile(min_count=0)
+    seconds, _ = _timed(toile.build,list(lines))
+    results["toile_build"] = {"seconds":seconds}
+
+    words = [generator.choice(generator.choice(tokens)) for i in range(max(1,n_queries//10))]
+    # misspelled: a letter replaced
+    misspelled = []
+    for word in words:
+        i = generator.randint(0,len(word)-1)
+        misspelled.append((word[:i]+generator.choice(LETTERS)+word[i+1:],))
+
+    results["closests"] = _latencies(lambda word: toile.get_closests(word,10),misspelled)
+    results["closests_full"] = _latencies(toile.get_closests,misspelled[:max(1,len(misspelled)//10)])
+    results["closests_max_dist"] = _latencies(lambda word: toile.get_closests(word,10,max_dist=1),misspelled)
+
+    results["peak_rss_bytes"] = _peak_rss()
+
+    return results
+
+# the measures compared, by the end of their names, and the ones where a higher value is better
+_MEASURES = ("seconds","_us","_per_s","bytes")
+_HIGHER = ("_per_s",)
+
+def compare(old,new,threshold=0.1):
+    """
+        Arguments:
+
+            old, new: two dictionnaries of results of run
+            threshold: the relative change reported as a regression (default 0.1)
+
+        Returns:
+
+            a list of (measure, old value, new value, relative change, regression)
+            for every timing, throughput and size of both results
+    """
+    changes = []
+    for name in sorted(set(old) & set(new)):
+        if name in ("parameters","environment"):
+            continue
+
+        if isinstance(new[name],dict):
+            measures = [(name+"."+key,old[name].get(key),value) for key, value in sorted(new[name].items())]
+        else:
+            measures = [(name,old[name],new[name])]
+
+        for measure, before, after in measures:
+            if not measure.endswith(_MEASURES) or not before:
+                continue
+
+            change = (after-before)/float(before)
+            if measure.endswith(_HIGHER):
+                regression = change < -threshold
+            else:
+                regression = change > threshold
+
+            changes.append((measure,before,after,change,regression))
+
+    return changes
+
+def main(argv=None):
+    """
+        toiledemots.py benchmark --lines 20000 --arity 3 --output results.json
+        toiledemots.py benchmark --compare before.json after.json
+    """
+    parser = argparse.ArgumentParser(prog="toiledemots.py benchmark",description="Benchmarks the n-grams, the language model and the toile "
+                                                 "on a synthetic corpus")
+    parser.add_argument("--lines",type=int,default=20000)
+    parser.add_argument("--arity",type=int,default=3)
+    parser.add_argument("--words",type=int,default=5000)
+    parser.add_argument("--queries",type=int,default=2000)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--output",default="benchmark.json",help="the JSON file of the results")
+    parser.add_argument("--compare",nargs=2,metavar=("OLD","NEW"),help="compare two JSON files of results")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        old, new = [json.load(open(file)) for file in args.compare]
+        regressions = 0
+        for measure, before, after, change, regression in compare(old,new):
+            print("%-32s %14.6g %14.6g %+8.1f%%%s" % (measure,before,after,change*100," REGRESSION" if regression else ""))
+            regressions += regression
+        return 1 if regressions else 0
+
+    results = run(args.lines,args.arity,args.words,args.queries,args.seed)
+
+    file = open(args.output,'w')
+    json.dump(results,file,indent=2,sort_keys=True)
+    file.close()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
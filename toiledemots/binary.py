@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+import math
+import mmap
+import struct
+from array import array
+
+from .table import NGramTable, QuantizedColumn, ID_TYPE, COUNT_TYPE
+
+__all__ = ['MAGIC', 'VERSION', 'STATISTICS', 'COUNT_OF_COUNTS', 'is_binary', 'quantize',
+           'write_model', 'read_model']
+
+MAGIC = b"TDMNGRAM"
+VERSION = 1
+
+# written in native byte order, BYTE_ORDER tells if it must be swapped
+BYTE_ORDER = 0x01020304
+HEADER = struct.Struct("=8sIIIIII")
+# bits of the quantised counts (0 if they are not), 1 if the continuation
+# statistics of a pruned model follow the orders
+OPTIONS = struct.Struct("=II")
+LENGTH = struct.Struct("=Q")
+
+# typecodes of the codes of quantised counts
+CODE_TYPES = {8: 'B', 16: 'H'}
+
+# the continuation statistics kept by nGrams.prune, one array per order
+# (from 1-grams) of a value for every n-gram: the number of (n+1)-grams
+# following it, the sum of their counts, the number of (n+1)-grams it
+# ends and the number of (n+2)-grams it is in the middle of
+STATISTICS = ['follow', 'follow_sum', 'continuation', 'middle']
+
+# the statistics also keep, for every order, the number of n-grams of
+# count 1 to COUNT_OF_COUNTS (the ones the discounts are computed from)
+COUNT_OF_COUNTS = 4
+
+# Layout of a binary model (every section is aligned on 8 bytes)
+#
+#   header: magic, byte order mark, version, number of orders,
+#           number of words, size of an id, size of a count
+#   options: bits of the quantised counts, statistics flag
+#   lengths: the number of n-grams of every order
+#   vocabulary: offsets of the words in the blob (number of words + 1),
+#               then the blob of the words encoded in utf-8
+#   orders: for every order, one column of ids per position then
+#           the column of counts, sorted like the NGramTables. Quantised
+#           counts are the length of the codebook, the codebook and the
+#           column of codes.
+#   statistics: if any, every array of STATISTICS for the orders 1 to n-1
+#               (1 to n-2 for middle), then the count of counts of every order
+
+def _padding(size):
+    return (-size) % 8
+
+def _write(file,data):
+    file.write(data)
+    file.write(b"\0"*_padding(len(data)))
+
+def _bytes(column):
+    return column.tobytes()
+
+def _column(buffer,offset,typecode,n):
+    """
+        Returns a column of n items read at offset in buffer, a view on
+        the buffer of a mapped file (no copy), else an array
+    """
+    size = array(typecode).itemsize*n
+    view = memoryview(buffer)[offset:offset+size]
+
+    if isinstance(buffer,mmap.mmap):
+        return view.cast(typecode)
+
+    column = array(typecode)
+    column.frombytes(view)
+    return column
+
+def _statistic_orders(name,n_orders):
+    if name == 'middle':
+        return range(1,n_orders-1)
+
+    return range(1,n_orders)
+
+def quantize(counts,bits):
+    """
+        Arguments:
+
+            counts: a column of counts
+            bits: the size of the codes, 8 or 16
+
+        Returns:
+
+            the codebook, an array of at most 2**bits counts, and the array of
+            the code of every count
+
+        The counts are exact if there are no more than 2**bits different ones.
+        Otherwise the smallest half of the codebook keeps the smallest counts
+        exact (the ones discounting relies on) and the larger counts are
+        binned on a logarithmic scale, every bin coded by its mean count.
+    """
+    if bits not in CODE_TYPES:
+        raise ValueError("counts can only be quantised on %s bits" % sorted(CODE_TYPES))
+
+    size = 2**bits
+
+    count_of_counts = {}
+    for count in counts:
+        count_of_counts[count] = count_of_counts.get(count,0) + 1
+
+    distinct = sorted(count_of_counts)
+
+    if len(distinct) <= size:
+        bins = [[count] for count in distinct]
+    else:
+        exact = size//2
+        bins = [[count] for count in distinct[:exact]]
+
+        rest = distinct[exact:]
+        n_bins = size - exact
+        low, high = float(rest[0]), float(rest[-1])
+
+        binned = [[] for i in range(n_bins)]
+        for count in rest:
+            # log(count/low)/log(high/low) is from 0 to 1
+            bin = int(n_bins*math.log(count/low)/math.log(high/low))
+            binned[min(n_bins-1,bin)].append(count)
+
+        bins += [counts_of_bin for counts_of_bin in binned if counts_of_bin]
+
+    codebook = array(COUNT_TYPE)
+    codes_of = {}
+    for code, counts_of_bin in enumerate(bins):
+        total = sum(count*count_of_counts[count] for count in counts_of_bin)
+        rows = sum(count_of_counts[count] for count in counts_of_bin)
+        codebook.append(int(round(total/float(rows))))
+
+        for count in counts_of_bin:
+            codes_of[count] = code
+
+    codes = array(CODE_TYPES[bits],[codes_of[count] for count in counts])
+
+    return codebook, codes
+
+def is_binary(file):
+    """
+        Arguments:
+
+            file: a file name
+
+        Returns:
+
+            True if the file is a binary model
+    """
+    file = open(file,'rb')
+    magic = file.read(len(MAGIC))
+    file.close()
+
+    return magic == MAGIC
+
+def write_model(file,words,tables,statistics=None,count_bits=None):
+    """
+        Arguments:
+
+            file: a file name or a binary file object
+            words: the words of the vocabulary, sorted by id
+            tables: the NGramTables of every order
+            statistics: the continuation statistics of a pruned model, a
+                dictionnary of the arrays of every order for every name of
+                STATISTICS and for count_of_counts (default None)
+            count_bits: quantise the counts on 8 or 16 bits (default None, exact counts)
+
+        Examples:
+
+            write_model("model.bin",vocabulary.words(),tables)
+            write_model("model.bin",vocabulary.words(),tables,count_bits=16)
+    """
+    if isinstance(file,str):
+        file = open(file,'wb')
+
+    file.write(HEADER.pack(MAGIC,BYTE_ORDER,VERSION,len(tables),len(words),
+                           array(ID_TYPE).itemsize,array(COUNT_TYPE).itemsize))
+    file.write(OPTIONS.pack(count_bits or 0,statistics is not None))
+
+    for table in tables:
+        file.write(LENGTH.pack(len(table)))
+
+    encoded = [word.encode('utf-8') for word in words]
+
+    offsets = array(COUNT_TYPE,[0])
+    for word in encoded:
+        offsets.append(offsets[-1]+len(word))
+
+    _write(file,_bytes(offsets))
+    _write(file,b"".join(encoded))
+
+    for table in tables:
+        for column in table.columns:
+            _write(file,_bytes(column))
+
+        counts = table.counts
+        if isinstance(counts,QuantizedColumn):
+            counts = array(COUNT_TYPE,counts)
+
+        if count_bits:
+            codebook, codes = quantize(counts,count_bits)
+            file.write(LENGTH.pack(len(codebook)))
+            _write(file,_bytes(codebook))
+            _write(file,_bytes(codes))
+        else:
+            _write(file,_bytes(counts))
+
+    if statistics is not None:
+        for name in STATISTICS:
+            for order in _statistic_orders(name,len(tables)):
+                _write(file,_bytes(statistics[name][order-1]))
+
+        for count_of_counts in statistics['count_of_counts']:
+            _write(file,_bytes(count_of_counts))
+
+    file.close()
+
+def read_model(file,max_arity=None,use_mmap=True):
+    """
+        Arguments:
+
+            file: a file name or a binary file object
+            max_arity: the maximal order to read (default None, every order)
+            use_mmap: map the file in memory instead of reading it (default True).
+                The columns are then views on the mapped pages, shared by every
+                process loading the same file.
+
+        Returns:
+
+            the words of the vocabulary, the NGramTables of every order and the
+            continuation statistics (None if the model was not pruned)
+
+        Examples:
+
+            words, tables, statistics = read_model("model.bin")
+    """
+    if isinstance(file,str):
+        file = open(file,'rb')
+
+    if use_mmap:
+        buffer = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+    else:
+        buffer = file.read()
+
+    file.close()
+
+    magic, byte_order, version, n_orders, n_words, id_size, count_size = HEADER.unpack_from(buffer,0)
+
+    if magic != MAGIC:
+        raise ValueError("not a binary n-gram model")
+    if version != VERSION:
+        raise ValueError("unsupported binary n-gram model version %i" % version)
+    if byte_order != BYTE_ORDER:
+        raise ValueError("binary n-gram model saved with another byte order")
+    if id_size != array(ID_TYPE).itemsize or count_size != array(COUNT_TYPE).itemsize:
+        raise ValueError("binary n-gram model saved with other integer sizes")
+
+    offset = HEADER.size
+
+    count_bits, has_statistics = OPTIONS.unpack_from(buffer,offset)
+    offset += OPTIONS.size
+
+    lengths = []
+    for i in range(n_orders):
+        lengths.append(LENGTH.unpack_from(buffer,offset)[0])
+        offset += LENGTH.size
+
+    offsets = _column(buffer,offset,COUNT_TYPE,n_words+1)
+    offset += offsets.itemsize*len(offsets)
+    offset += _padding(offset)
+
+    blob = bytes(buffer[offset:offset+offsets[-1]])
+    words = [blob[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(n_words)]
+    offset += len(blob)
+    offset += _padding(offset)
+
+    n_read = n_orders
+    if max_arity is not None:
+        n_read = min(n_orders,max_arity)
+
+    # every order is gone through to find the statistics after them
+    tables = []
+    for order in range(1,n_orders+1):
+        n = lengths[order-1]
+
+        columns = []
+        for i in range(order):
+            columns.append(_column(buffer,offset,ID_TYPE,n))
+            offset += id_size*n
+            offset += _padding(offset)
+
+        if count_bits:
+            n_codes = LENGTH.unpack_from(buffer,offset)[0]
+            offset += LENGTH.size
+
+            codebook = _column(buffer,offset,COUNT_TYPE,n_codes)
+            offset += count_size*n_codes
+            offset += _padding(offset)
+
+            codes = _column(buffer,offset,CODE_TYPES[count_bits],n)
+            offset += codes.itemsize*n
+            offset += _padding(offset)
+
+            counts = QuantizedColumn(codes,array(COUNT_TYPE,codebook))
+        else:
+            counts = _column(buffer,offset,COUNT_TYPE,n)
+            offset += count_size*n
+            offset += _padding(offset)
+
+        if order <= n_read:
+            tables.append(NGramTable(order,columns,counts))
+
+    statistics = None
+    if has_statistics:
+        statistics = {}
+        for name in STATISTICS:
+            statistics[name] = []
+            for order in _statistic_orders(name,n_orders):
+                n = lengths[order-1]
+                if order <= n_read:
+                    statistics[name].append(_column(buffer,offset,COUNT_TYPE,n))
+                offset += count_size*n
+                offset += _padding(offset)
+
+        statistics['count_of_counts'] = []
+        for order in range(1,n_read+1):
+            statistics['count_of_counts'].append(_column(buffer,offset,COUNT_TYPE,COUNT_OF_COUNTS))
+            offset += count_size*COUNT_OF_COUNTS
+
+    return words, tables, statistics
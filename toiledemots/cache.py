@@ -1,9 +1,8 @@
 #!/bin/python
 # -*- coding: utf-8 -*-
 
-import time
-import os
-import ctypes
+import sys
+from collections import OrderedDict
 
 __all__ = ['Cache']
 
@@ -11,43 +10,78 @@ class Cache(dict):
     """
         Cached dictionnary
 
-        Arguments: 
+        Arguments:
 
-            max: maximum size of the cache
+            max: maximum number of items in the cache
+            max_bytes: maximum size in bytes of the cached values (default None, no limit)
+            sizeof: function giving the size in bytes of a value (default sys.getsizeof)
             **d: dictionnary items
 
         Works like a dictionnary but with a maximum size.
 
-        When there is more items than the maximum size, the ones accessed more lately are 
-        deleted to make space for a new item
+        When there is more items than the maximum size (or when the values take more
+        bytes than max_bytes), the ones accessed least recently are deleted to make
+        space for a new item. Every access, insertion and eviction is O(1).
+
+        The number of hits, misses and evictions are kept in the attributes
+        hits, misses and evictions. Only get and [] count the hits and the
+        misses (not in), so a value should be looked up with get. The other
+        methods of dict (pop, popitem, setdefault, update, copy, ...) keep
+        the order of use and the limits of the cache too.
 
         Examples:
 
             cache = Cache(10,some="items",in="the",dict="ionnary")
-            cache["new"] = "items"
-            
+            cache["new"] = "items"
+
             cache.get("get","if not in")
             cache["getitem"]
+
+            cache = Cache(4000,max_bytes=2**20)
+            cache.stats()
     """
-    def __init__(self,max,**d):
+    def __init__(self,max,max_bytes=None,sizeof=sys.getsizeof,**d):
         """
             Arguments:
 
-                max: maximum size of the cache 
+                max: maximum number of items in the cache
+                max_bytes: maximum size in bytes of the cached values (default None)
+                sizeof: function giving the size in bytes of a value (default sys.getsizeof)
                 **d: dictionnary items
 
             Examples:
-            
+
                 cache = Cache(5)
 
                 cache = Cache(5,the="items",are="optional")
         """
-        self.start = time.time()
         self.max = max
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # keys from the least recently used to the most recently used,
+        # with the size of their value
+        self.__lru = OrderedDict()
 
         for key,item in d.items():
             self[key] = item
 
+    def __touch(self,key):
+        self.__lru[key] = self.__lru.pop(key)
+
+    def __evict(self):
+        while (len(self)>self.max or
+               (self.max_bytes is not None and self.nbytes>self.max_bytes and len(self)>1)):
+            key, size = self.__lru.popitem(last=False)
+            dict.__delitem__(self,key)
+            self.nbytes -= size
+            self.evictions += 1
+
     def __setitem__(self,key,value):
         """
             Arguments:
@@ -55,40 +89,53 @@ class Cache(dict):
                 key: key to access the value later on (most be hashable)
                 value: the value to store
 
-            A time value is stored together with the key and the value 
-            to evaluate if the tuple (key,value) should be keep when 
-            the cache is full.
- 
+            The key becomes the most recently used one. If the cache
+            is full, the least recently used items are deleted.
+
             Examples:
 
                 cache = Cache(10)
                 cache["key"]="value"
        """
-        dict.__setitem__(self,key,(time.time()-self.start,value))
+        if key in self.__lru:
+            self.nbytes -= self.__lru.pop(key)
+
+        size = self.sizeof(value) if self.max_bytes is not None else 0
 
-        if len(self)>self.max:
+        dict.__setitem__(self,key,value)
+        self.__lru[key] = size
+        self.nbytes += size
+
+        self.__evict()
 
-            for key, item in sorted(self.items(),key=lambda a:a[1][0])[:len(self)-self.max]:
-                del self[key]
-            
     def __getitem__(self,key):
         """
             Arguments:
 
                 key: key to access the value
 
-            The time value is updated in order to keep the tuple (key,value) 
-            in the dict if it is accessed frequently enough while the 
-            cache is full.
- 
+            The key becomes the most recently used one in order to keep
+            the tuple (key,value) in the dict if it is accessed frequently
+            enough while the cache is full.
+
             Examples:
 
                 cache = Cache(10,key="value")
                 cache["key"]
        """
-        item = dict.__getitem__(self,key)
-        self[key] = item[1]
-        return item[1]
+        try:
+            value = dict.__getitem__(self,key)
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.hits += 1
+        self.__touch(key)
+        return value
+
+    def __delitem__(self,key):
+        dict.__delitem__(self,key)
+        self.nbytes -= self.__lru.pop(key)
 
     def get(self,key,ifnot=None):
         """
@@ -100,7 +147,7 @@ class Cache(dict):
 
             No exception are raised if the key is not in the cache.
             The ifnot value is returned when the key is not in the cache.
-            The time value updated if the key was in the cache.
+            The key becomes the most recently used one if it was in the cache.
 
             Examples:
 
@@ -108,23 +155,124 @@ class Cache(dict):
                 cache.get("nokey")==None
                 cache.get("nokey","value")=="value"
        """
-        item = dict.get(self,key,ifnot)
+        if key not in self.__lru:
+            self.misses += 1
+            return ifnot
+
+        self.hits += 1
+        self.__touch(key)
+        return dict.__getitem__(self,key)
+
+    def pop(self,key,*ifnot):
+        if key not in self.__lru:
+            return dict.pop(self,key,*ifnot)
+
+        self.nbytes -= self.__lru.pop(key)
+        return dict.pop(self,key)
+
+    def popitem(self):
+        """
+            Removes the least recently used item
 
-        if item!=ifnot:
-            self[key] = item[1]
-            return item[1]
+            Returns:
+
+                the tuple (key,value) of the item, a KeyError is raised if
+                the cache is empty
+        """
+        if not self.__lru:
+            raise KeyError("popitem(): cache is empty")
+
+        key, size = self.__lru.popitem(last=False)
+        self.nbytes -= size
+        return key, dict.pop(self,key)
+
+    def setdefault(self,key,ifnot=None):
+        """
+            Returns the value of key like get, after storing ifnot in the
+            cache if key is not in it (without counting a hit or a miss)
+        """
+        if key in self.__lru:
+            self.__touch(key)
+            return dict.__getitem__(self,key)
 
+        self[key] = ifnot
         return ifnot
 
+    def update(self,*args,**d):
+        for key,item in dict(*args,**d).items():
+            self[key] = item
+
+    def __ior__(self,other):
+        self.update(other)
+        return self
+
+    def copy(self):
+        """
+            Returns:
+
+                a new Cache with the same limits and items, in the same
+                order of use, its hits, misses and evictions at 0
+        """
+        cache = Cache(self.max,self.max_bytes,self.sizeof)
+        for key in self.__lru:
+            cache[key] = dict.__getitem__(self,key)
+
+        return cache
+
+    @classmethod
+    def fromkeys(cls,keys,value=None,max=None,**options):
+        """
+            Returns:
+
+                a new Cache of the keys with value, of max items
+                (default the number of keys), see Cache for the options
+        """
+        keys = list(keys)
+        cache = cls(max if max is not None else len(keys),**options)
+        for key in keys:
+            cache[key] = value
+
+        return cache
+
+    def clear(self):
+        dict.clear(self)
+        self.__lru.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """
+            Returns:
+
+                A dictionnary with the number of hits, misses, evictions,
+                items and bytes of the cache
+
+            Examples:
+
+                cache = Cache(10)
+                cache.get("nokey")
+                cache.stats()["misses"]==1
+        """
+        return {"hits":self.hits,
+                "misses":self.misses,
+                "evictions":self.evictions,
+                "items":len(self),
+                "bytes":self.nbytes}
+
 if __name__=="__main__":
     c = Cache(20)
-    print c.get("test")
+    print(c.get("test"))
     c["test"]="value"
-    print c.get("test")
+    print(c.get("test"))
 
     for i in range(40000):
         c[i] = i
-        print c.get(5,None)
-        print c.items()[0]
-        print sorted(c.items(),key=lambda a:a[1][0])
-        time.sleep(1.0)
+        c.get(5,None)
+
+    print(sorted(c.keys()))
+    print(c.stats())
+
+    c = Cache(1000,max_bytes=1000)
+    for i in range(100):
+        c[i] = "x"*100
+
+    print(len(c), c.nbytes, c.stats())
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .timer import seconds_to_string
+
+__all__ = ['Metrics', 'Progress', 'StderrSink', 'JSONLinesSink', 'MemorySink',
+           'get_metrics', 'set_metrics']
+
+# seconds between two progress events of the same task
+PROGRESS_INTERVAL = 120
+
+class StderrSink(object):
+    """
+        Writes the phases and the progress events in a readable form
+
+        Arguments:
+
+            out: the file written to (default sys.stderr)
+    """
+
+    def __init__(self,out=None):
+        self.out = out
+
+    def __call__(self,event):
+        out = self.out or sys.stderr
+
+        if event["type"] == "phase":
+            out.write("%s : %s (%.3f s)\n" % (event["name"],seconds_to_string(event["seconds"]),event["seconds"]))
+        elif event["type"] == "progress" and event["remaining"] is not None:
+            out.write("%s : time remaining : %s\n" % (event["name"],seconds_to_string(event["remaining"])))
+        elif event["type"] == "progress":
+            out.write("%s : %i done\n" % (event["name"],event["done"]))
+        elif event["type"] == "snapshot":
+            for name, value in sorted(event["counters"].items()):
+                out.write("%s : %s\n" % (name,value))
+            for name, stats in sorted(event["caches"].items()):
+                out.write("%s : %s\n" % (name,", ".join("%s %i" % item for item in sorted(stats.items()))))
+
+class JSONLinesSink(object):
+    """
+        Writes every event as a line of JSON
+
+        Arguments:
+
+            file: a file name (appended to) or a file object
+    """
+
+    def __init__(self,file):
+        if isinstance(file,str):
+            file = open(file,'a')
+
+        self.file = file
+
+    def __call__(self,event):
+        import json
+
+        self.file.write(json.dumps(event,sort_keys=True)+"\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class MemorySink(object):
+    """
+        Keeps every event in the list events
+
+        Examples:
+
+            sink = MemorySink()
+            metrics = Metrics([sink])
+            ngrams = nGrams(3,metrics=metrics)
+            ngrams.build(lines)
+            sink.of("phase")
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self,event):
+        self.events.append(event)
+
+    def of(self,type,name=None):
+        """
+            Returns:
+
+                the events of type (and of name if given)
+        """
+        return [event for event in self.events
+                if event["type"] == type and (name is None or event["name"] == name)]
+
+class Progress(object):
+    """
+        Progress of a task of todo operations, emits a progress event with the
+        estimated remaining time at most every progress_interval seconds
+
+        Examples:
+
+            progress = metrics.progress("ngrams.save",len(ngrams))
+            for ...:
+                progress.update(1)
+    """
+
+    def __init__(self,metrics,name,todo=None):
+        self.metrics = metrics
+        self.name = name
+        self.todo = todo
+        self.done = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def update(self,done):
+        self.done += done
+
+        now = time.time()
+        if now - self.last < self.metrics.progress_interval:
+            return
+
+        self.last = now
+
+        remaining = None
+        if self.todo is not None and self.done:
+            remaining = (now-self.start)/float(self.done)*max(0,self.todo-self.done)
+
+        self.metrics.emit("progress",self.name,done=self.done,todo=self.todo,
+                          seconds=now-self.start,remaining=remaining)
+
+class Metrics(object):
+    """
+        Phases, counters and gauges of the n-grams, the language models and the toiles
+
+        Arguments:
+
+            sinks: the functions called with every event, a list
+                (default None, no sink)
+            progress_interval: the seconds between two progress events of a
+                task (default PROGRESS_INTERVAL)
+
+        A phase is a named step timed on the wall clock (ex: ngrams.sort),
+        its duration is emitted as an event when it ends and added to its
+        total. The counters (ex: lm.p) and the gauges (ex: ngrams.order.3)
+        are only kept, with the statistics of the watched caches, until
+        snapshot or flush.
+
+        Every event has a type (phase, progress or snapshot), a name and a
+        time, plus the values of its type.
+
+        Examples:
+
+            sink = MemorySink()
+            metrics = Metrics([StderrSink(),JSONLinesSink("metrics.jsonl"),sink])
+
+            with metrics.phase("parse"):
+                ...
+
+            metrics.count("lines",len(lines))
+            metrics.watch("ngrams.sum",cache)
+            metrics.flush()
+    """
+
+    def __init__(self,sinks=None,progress_interval=PROGRESS_INTERVAL):
+        self.sinks = list(sinks or [])
+        self.progress_interval = progress_interval
+        # name -> weak references to the caches, so that they are not kept alive
+        self.__caches = defaultdict(list)
+        self.reset()
+
+    def reset(self):
+        """
+            Empties the phases, the counters and the gauges, the watched
+            caches stay watched
+        """
+        self.phases = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    def emit(self,type,name,**values):
+        event = dict(values)
+        event.update(type=type,name=name,time=time.time())
+
+        for sink in self.sinks:
+            sink(event)
+
+    def record(self,name,seconds,**values):
+        """
+            Adds seconds to the phase name and emits its event, values are
+            added to the event
+        """
+        self.phases[name] += seconds
+        self.calls[name] += 1
+        self.emit("phase",name,seconds=seconds,**values)
+
+    @contextmanager
+    def phase(self,name,**values):
+        """
+            Times the block as the phase name
+
+            Examples:
+
+                with metrics.phase("ngrams.sort",order=3):
+                    ...
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name,time.time()-start,**values)
+
+    def count(self,name,n=1):
+        self.counters[name] += n
+
+    def gauge(self,name,value):
+        self.gauges[name] = value
+
+    def progress(self,name,todo=None):
+        """
+            Returns:
+
+                a new Progress of the task name of todo operations (None if unknown)
+        """
+        return Progress(self,name,todo)
+
+    def watch(self,name,cache):
+        """
+            Adds the hits, misses, evictions, items and bytes of cache (see
+            Cache.stats) to the ones of name in the snapshots, while the
+            cache lives
+        """
+        references = self.__caches[name]
+        references[:] = [reference for reference in references if reference() is not None]
+        references.append(weakref.ref(cache))
+
+    def snapshot(self):
+        """
+            Returns:
+
+                a dictionnary of the phases (their seconds and calls), the
+                counters, the gauges and the caches (their summed stats)
+        """
+        caches = {}
+        for name, references in self.__caches.items():
+            stats = defaultdict(int)
+            for reference in references:
+                cache = reference()
+                if cache is not None:
+                    for key, value in cache.stats().items():
+                        stats[key] += value
+            caches[name] = dict(stats)
+
+        return {"phases":dict((name,{"seconds":seconds,"calls":self.calls[name]})
+                              for name, seconds in self.phases.items()),
+                "counters":dict(self.counters),
+                "gauges":dict(self.gauges),
+                "caches":caches}
+
+    def flush(self):
+        """
+            Emits the snapshot as an event
+        """
+        self.emit("snapshot","metrics",**self.snapshot())
+
+_metrics = Metrics([StderrSink()])
+
+def get_metrics():
+    """
+        Returns:
+
+            the Metrics of the objects created without metrics (by default
+            writing to stderr)
+    """
+    return _metrics
+
+def set_metrics(metrics):
+    """
+        Sets the Metrics of the objects created without metrics from now on
+
+        Examples:
+
+            set_metrics(Metrics([JSONLinesSink("metrics.jsonl")]))
+    """
+    global _metrics
+    _metrics = metrics
+
+if __name__ == "__main__":
+    sink = MemorySink()
+    metrics = Metrics([StderrSink(),sink],progress_interval=0)
+
+    with metrics.phase("sleep"):
+        time.sleep(0.1)
+
+    progress = metrics.progress("loop",3)
+    for i in range(3):
+        progress.update(1)
+
+    metrics.count("loops",3)
+    metrics.gauge("items",42)
+    metrics.flush()
+
+    print(sink.of("phase"))
+    print(metrics.snapshot())
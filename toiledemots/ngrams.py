@@ -2,14 +2,33 @@
 
 import sys
 import time
-import datetime
-import re
 from collections import defaultdict
-from timer import Timer, seconds_to_string
-import codecs
-from cache import Cache
+from .metrics import get_metrics
+from .cache import Cache
+from .vocabulary import Vocabulary
+from .table import NGramTable, COUNT_TYPE
+from array import array
+from .tokenizer import Tokenizer, CLEAN_STR
+from . import binary
 
 import copy
+from bisect import bisect_left, bisect_right
+import itertools
+import os
+from .runs import write_run, read_run, merge_runs
+
+# approximate number of bytes taken by one n-gram while counting
+# (dictionnary slot, tuple of ids and count)
+COUNTING_BYTES = 160
+
+# number of lines between two checks of the memory taken by the counts
+MEMORY_CHECK = 1000
+
+# number of lines tokenized at once
+BATCH_LINES = 1000
+
+# number of lines counted by a worker at once in a parallel build
+CHUNK_LINES = 10000
 
 
 # wildcard replaced by (i) (j is useless? => (0,3) is sorted as (0,2))
@@ -18,7 +37,26 @@ import copy
 #sandwich -> search_range(item,
 #               sorted_reversed_words(search_range(item,sorted_list)))
 
-def search_ngram_range(ngram,l,wildcard=(0,0)):
+def _compare(gram,ngram,start,stop):
+    """
+        compares gram[start:stop] to ngram[start:stop] without slicing them
+    """
+    for k in range(start,stop):
+        if gram[k] != ngram[k]:
+            if gram[k] < ngram[k]:
+                return -1
+            return 1
+
+    return 0
+
+def ngram_keys(l,wildcard):
+    """
+        Returns the keys searched by search_ngram_range in l with wildcard,
+        to compute them once for many searches
+    """
+    return [gram[wildcard[0]:wildcard[1]] for gram in l]
+
+def search_ngram_range(ngram,l,wildcard=(0,0),keys=None):
     """
         search ngrams fitting *ngram*
 
@@ -27,6 +65,9 @@ def search_ngram_range(ngram,l,wildcard=(0,0)):
             ngram: the ngram to fit
             l: the list of ngrams
             wildcard: the wildcard to apply on ngram
+            keys: the keys of l for this wildcard, see ngram_keys (default None).
+                The search bisects them, otherwise it compares the words of
+                the ngrams of l one by one.
 
         Examples:
 
@@ -36,43 +77,52 @@ def search_ngram_range(ngram,l,wildcard=(0,0)):
             # it returns all the elements in l
             # that has the word two and three at 
             # index 1 and 2
-    """
 
-    i_min = 0
-    i,j = 0,len(l)-1
+            keys = ngram_keys(l,(1,3))
+            search_ngram_range(ngram,l,wildcard=(1,0),keys=keys)
+    """
 
     if wildcard[1] <= 0:
         wildcard = (wildcard[0], wildcard[1]+len(ngram))
 
-    e = len(ngram)
-    ngram = ngram[wildcard[0]:wildcard[1]]
+    if keys is not None:
+        key = ngram[wildcard[0]:wildcard[1]]
+        i_min = bisect_left(keys,key)
+        return (i_min,bisect_right(keys,key,i_min))
 
-    while j >= i:
-        m = (j+i)/2
-
-        if l[m][wildcard[0]:wildcard[1]] < ngram:
+    i,j = 0,len(l)
+    while i < j:
+        m = (i+j)//2
+        if _compare(l[m],ngram,wildcard[0],wildcard[1]) < 0:
             i = m+1
-            i_min=i
         else:
-            j = m-1
-
-    i -= 1
-    j = len(l)-1
-    i_max = len(l)
+            j = m
+    i_min = i
 
-    while j >= i:
-        m = (j+i)/2
-
-        if l[m][wildcard[0]:wildcard[1]] <= ngram:
+    j = len(l)
+    while i < j:
+        m = (i+j)//2
+        if _compare(l[m],ngram,wildcard[0],wildcard[1]) <= 0:
             i = m+1
         else:
-            j = m-1
-            i_max=m
+            j = m
 
-    return (i_min,i_max)
+    return (i_min,i)
 
+def joined_keys(l):
+    """
+        Returns the keys searched by search_range in l, to compute them
+        once for many searches
+    """
+    return [u"".join(gram) for gram in l]
 
-def search_range(item,l):
+def _prefix_bound(item):
+    """
+        Returns the smallest string greater than every string beginning with item
+    """
+    return item[:-1] + chr(ord(item[-1])+1)
+
+def search_range(item,l,keys=None):
     """
         search ngrams begginning with item
 
@@ -80,6 +130,8 @@ def search_range(item,l):
             
             item: the word to fit
             l: the list of ngrams
+            keys: the joined words of the ngrams of l, see joined_keys
+                (default None, they are computed from l)
 
         Examples:
 
@@ -89,36 +141,123 @@ def search_range(item,l):
             # it returns all the elements in l
             # that begins with u"onetwo"
     """
-    i_min = 0
-    i,j = 0,len(l)-1
 
-    item = "".join(item)
+    if keys is None:
+        keys = joined_keys(l)
 
-    e = len(item)
+    item = u"".join(item)
 
-    while j >= i:
-        m = (j+i)/2
+    i_min = bisect_left(keys,item)
 
-        if "".join(l[m]) < item:
-            i = m+1
-            i_min=i
-        else:
-            j = m-1
+    if not item:
+        return (i_min,len(keys))
 
-    i -= 1
-    j = len(l)-1
-    i_max = len(l)
+    return (i_min,bisect_left(keys,_prefix_bound(item),i_min))
 
-    while j >= i:
-        m = (j+i)/2
+def count_ids(ids,counting,pad):
+    """
+        counts the n-grams of a line
 
-        if "".join(l[m])[:e] <= item:
-            i = m+1
-        else:
-            j = m-1
-            i_max=m
+        Arguments:
+
+            ids: the word ids of the line
+            counting: one defaultdict(int) per order, keyed by tuples of word ids
+            pad: the id of the empty word padding the line
+
+        The line is padded with n-1 empty words before it and, if it has at
+        least n words, n empty words after it. Every n-gram ending after the
+        leading padding is counted.
+
+        Examples:
+
+            counting = [defaultdict(int) for i in range(3)]
+            count_ids(tokenizer.encode(u"C'est un test bien simple",vocabulary),counting,vocabulary.add(u""))
+    """
+
+    max_arity = len(counting)
+
+    if not ids:
+        return
+
+    padded = [pad]*(max_arity-1) + list(ids)
+    if len(ids) >= max_arity:
+        padded += [pad]*max_arity
+
+    for i, counts in enumerate(counting):
+        for ngram in zip(*[padded[max_arity-i-1+j:] for j in range(i+1)]):
+            counts[ngram] += 1
+
+def _count_chunk(args):
+    """
+        counts a chunk of lines in a worker process
 
-    return (i_min,i_max)
+        Returns:
+
+            the sorted words of the chunk vocabulary and one sorted NGramTable
+            per order, keyed by the ids of these words. The ids following the
+            order of the words like the ones of the final vocabulary, the
+            tables are sorted runs of the final tables once renumbered.
+    """
+
+    lines, tokenizer, max_arity = args
+
+    vocabulary = Vocabulary()
+    pad = vocabulary.add(u"")
+    counting = [defaultdict(int) for i in range(max_arity)]
+
+    for ids in tokenizer.encode_batch(lines,vocabulary):
+        count_ids(ids,counting,pad)
+
+    remap = vocabulary.sort()
+
+    tables = []
+    for i in range(max_arity):
+        tables.append(NGramTable.from_items(i+1,counting[i],remap))
+        counting[i] = None
+
+    return vocabulary.words(), tables
+
+def _renumbered_run(table,ids):
+    """
+        Returns a generator over the sorted (key, count) pairs of table, the
+        ids of its keys being replaced by ids[id] (an increasing mapping, so
+        that the pairs stay sorted)
+    """
+    columns = [map(ids.__getitem__,column) for column in table.columns]
+
+    return zip(zip(*columns),table.counts)
+
+def _combine_chunks(first,second):
+    """
+        Returns the words and the tables of two chunks (see _count_chunk)
+        merged together, keyed by the ids of the sorted words of both
+    """
+    words = sorted(set(first[0]).union(second[0]))
+    index = dict((word,id) for id, word in enumerate(words))
+    first_ids = [index[word] for word in first[0]]
+    second_ids = [index[word] for word in second[0]]
+
+    tables = []
+    for first_table, second_table in zip(first[1],second[1]):
+        runs = [_renumbered_run(first_table,first_ids),_renumbered_run(second_table,second_ids)]
+        tables.append(NGramTable.from_sorted(first_table.order,merge_runs(runs)))
+
+    return words, tables
+
+class _DecodedGrams(object):
+    """
+        Read-only list of the n-grams of a table, decoded when accessed
+    """
+
+    def __init__(self,table,vocabulary):
+        self.table = table
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self,row):
+        return self.vocabulary.decode(self.table.key(row))
 
 class nGrams(object):
     """
@@ -130,7 +269,8 @@ class nGrams(object):
 
         An n-gram dictionnary that stores the n-gram and their counts. It is optimized
         to respond countly to successiv request (the first answer might be slow). 
-        The drawback is that it may take a lot of memory space.
+        The words are interned in a Vocabulary and every order is stored as packed
+        columns of word ids plus a column of counts (see NGramTable).
 
         Example:
 
@@ -145,13 +285,16 @@ class nGrams(object):
             ...
     """
 
-    def __init__(self,max_arity,min_count=0):
+    def __init__(self,max_arity,min_count=0,metrics=None):
         """
             n-gram
 
             Arguments:
                 
                 max_arity: the maximal arity of the n-gram. It will contain 1-gram,2-gram, ... up to n-gram
+                min_count: the minimal count of the n-grams (default 0)
+                metrics: the Metrics of the phases of build, load and save and of
+                    the caches (default metrics.get_metrics())
 
             An n-gram dictionnary that stores the n-gram and their counts. It is optimized
             to respond countly to successiv request (the first answer might be slow). 
@@ -163,28 +306,62 @@ class nGrams(object):
         """
 
         self.__max_arity = max_arity
-        self.__ngrams = [defaultdict(int) for i in range(self.__max_arity)]
-        self.__sorted_grams = [{} for i in range(self.__max_arity)]
+        self.__vocabulary = Vocabulary()
+        self.__tables = [NGramTable(i+1) for i in range(self.__max_arity)]
         self.__len = 0
         self.__nlen = [0 for i in range(self.__max_arity)]
         self.__sum = Cache(4000)
-        self.__nc = Cache(4000)
         self.__contains = Cache(4000)
         self.__lencontains = Cache(4000)
-        self.__gwc = Cache(4000)
-        self.__n = Cache(4000)
+        self.__joined = {}
+        # incremented whenever the n-grams, their ids or their minimal count
+        # change, so that the caches of the language models can be emptied
+        self.version = 0
+        # the continuation statistics kept by prune
+        self.__statistics = None
 
         self.__min_count = min_count
 
+        self.metrics = metrics if metrics is not None else get_metrics()
+        for name, cache in [("ngrams.sum",self.__sum),("ngrams.contains",self.__contains),
+                            ("ngrams.lencontains",self.__lencontains)]:
+            self.metrics.watch(name,cache)
+
     def get_max_arity(self):
         """
         """
 
-        return len(self.__ngrams)#self.__max_arity
+        return len(self.__tables)#self.__max_arity
+
+    def get_vocabulary(self):
+        return self.__vocabulary
+
+    def table(self,order):
+        """
+            Returns:
+
+                the NGramTable of the order-grams
+        """
+        return self.__tables[order-1]
+
+    def row(self,ngram):
+        """
+            Returns:
+
+                the row of ngram in the table of its order, -1 if it is not in it
+        """
+        if not ngram:
+            return -1
+
+        return self.__find(ngram)[1]
 
     def set_minimal_count(self,minimal_count):
         self.__min_count = minimal_count
 
+        for cache in [self.__sum,self.__contains,self.__lencontains]:
+            cache.clear()
+        self.version += 1
+
     def get_minimal_count(self):
         return self.__min_count
 
@@ -200,113 +377,405 @@ class nGrams(object):
         
         # we gap the max_arity
         ngrams.__max_arity = max_arity
-        ngrams.__ngrams = ngrams.__ngrams[:max_arity]
-        ngrams.__sorted_grams = ngrams.__sorted_grams[:max_arity]
+        ngrams.__tables = ngrams.__tables[:max_arity]
         ngrams.__nlen = ngrams.__nlen[:max_arity]
 
         return ngrams
 
 #    def set_max_arity(self,max_arity):
 #        if self.__max_arity > max_arity:
-#            for i in xrange(max_arity,self.__max_arity):
+#            for i in range(max_arity,self.__max_arity):
 #                del self.__ngrams[i]
 #            self.__max_arity = max_arity
 #        elif self.__max_arity < max_arity:
 #            raise ValueError("max_arity can only be smaller than current one, otherwise build again a new n-gram")
 
-    def __init_buffer(self):
-        return ["" for i in range(self.__max_arity)]
+    def __count_serial(self,lines,counting,tokenizer,timings):
+        """
+            Counts the lines by batches, yields the number of lines counted.
+            The seconds spent tokenizing and counting are added to timings.
+        """
+
+        lines = iter(lines)
+        pad = self.__vocabulary.add(u"")
+
+        while True:
+            batch = list(itertools.islice(lines,BATCH_LINES))
+            if not batch:
+                break
+
+            start = time.time()
+            encoded = tokenizer.encode_batch(batch,self.__vocabulary)
+            tokenized = time.time()
+
+            for ids in encoded:
+                count_ids(ids,counting,pad)
+
+            timings["ngrams.tokenize"] += tokenized-start
+            timings["ngrams.count"] += time.time()-tokenized
+
+            yield len(batch)
+
+    def __count_parallel(self,lines,chunks,tokenizer,workers,timings):
+        """
+            Counts chunks of lines in a pool of workers, keeps the words and
+            the sorted tables of the chunks in chunks (see _count_chunk) and
+            yields the number of lines counted after every chunk. The seconds
+            spent waiting for the workers and merging are added to timings.
+
+            The chunks are merged as they arrive like in a merge sort: chunks
+            holds (words, tables, number of chunks merged) and two tables of
+            the same number of chunks are merged together, so only about
+            log2 of the number of chunks tables are kept. The last ones are
+            merged by __merge_chunks once every line is counted.
+        """
+
+        # imported when needed, so that importing the module stays cheap
+        import multiprocessing
+
+        lines = iter(lines)
+        pool = multiprocessing.Pool(workers)
+
+        def merge(result):
+            words, tables = result
+            for word in words:
+                self.__vocabulary.add(word)
+
+            merged = 1
+            while chunks and chunks[-1][2] == merged:
+                previous_words, previous_tables, n = chunks.pop()
+                words, tables = _combine_chunks((previous_words,previous_tables),(words,tables))
+                merged += n
+
+            chunks.append((words,tables,merged))
+
+        try:
+            # at most 2 chunks per worker are waiting, so the input is not
+            # read faster than it is counted
+            pending = []
+            while True:
+                chunk = list(itertools.islice(lines,CHUNK_LINES))
+                if not chunk:
+                    break
+
+                pending.append((len(chunk),pool.apply_async(_count_chunk,((chunk,tokenizer,self.__max_arity),))))
+
+                if len(pending) >= 2*workers:
+                    n, result = pending.pop(0)
+                    start = time.time()
+                    merge(result.get())
+                    timings["ngrams.count"] += time.time()-start
+                    yield n
+
+            for n, result in pending:
+                start = time.time()
+                merge(result.get())
+                timings["ngrams.count"] += time.time()-start
+                yield n
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __finalize(self,counting):
+        """
+            Sorts the vocabulary and packs the counts of every order
+            (dictionnaries keyed by tuples of ids) into NGramTables
+        """
+
+        remap = self.__vocabulary.sort()
+
+        tables = []
+        for i in range(len(counting)):
+            tables.append(NGramTable.from_items(i+1,counting[i],remap))
+            counting[i] = None
+
+        self.__set_tables(tables)
+
+    def __merge_chunks(self,counting,chunks):
+        """
+            Sorts the vocabulary and merges the sorted tables of the chunks
+            counted by the workers, plus the counts of counting, into
+            NGramTables without sorting them again
+        """
 
-    def __update_buffer(self,n_buffer,word):
-        n_buffer = n_buffer[1:] + [word]
+        remap = self.__vocabulary.sort()
+        ids = [[self.__vocabulary[word] for word in words] for words, tables, merged in chunks]
 
-        for i in range(self.__max_arity):
-            self.__ngrams[i][tuple([w for w in n_buffer[self.__max_arity-i-1:]])] += 1
+        tables = []
+        for i in range(len(counting)):
+            runs = [sorted((tuple([remap[id] for id in key]),count) for key, count in counting[i].items())]
+            for chunk_ids, (words,chunk_tables,merged) in zip(ids,chunks):
+                runs.append(_renumbered_run(chunk_tables[i],chunk_ids))
+
+            tables.append(NGramTable.from_sorted(i+1,merge_runs(runs)))
+
+            counting[i] = None
+            for words, chunk_tables, merged in chunks:
+                chunk_tables[i] = None
+
+        del chunks[:]
+
+        self.__set_tables(tables)
+
+    def __spill(self,counting,runs,run_dir,chunks=()):
+        """
+            Writes the counts of every order, with the tables of the chunks
+            counted by the workers, in a new sorted run on disk and empties
+            them. The keys of the runs are tuples of words, so the runs are
+            sorted the same way as the final tables.
+        """
+
+        decode = self.__vocabulary.decode
+
+        with self.metrics.phase("ngrams.spill"):
+            for i, counts in enumerate(counting):
+                items = [sorted((decode(key),count) for key, count in counts.items())]
+                for words, tables, merged in chunks:
+                    items.append(_renumbered_run(tables[i],words))
+
+                path = os.path.join(run_dir,"%i-%i" % (i+1,len(runs[i])))
+                write_run(path,merge_runs(items))
+                runs[i].append(path)
+                counts.clear()
+
+            del chunks[:]
+
+    def __merge(self,runs):
+        """
+            Merges the sorted runs of every order into NGramTables
+        """
+
+        self.__vocabulary.sort()
+        encode = self.__vocabulary.encode
+
+        tables = []
+        for i, paths in enumerate(runs):
+            items = merge_runs([read_run(path) for path in paths])
+            tables.append(NGramTable.from_sorted(i+1,((encode(key),count) for key, count in items)))
+
+        self.__set_tables(tables)
+
+    def __set_tables(self,tables,statistics=None):
+        self.__tables = tables
+        self.__statistics = statistics
+        self.version += 1
+        self.__max_arity = len(self.__tables)
+        self.__len = 0
+        self.__nlen = [0 for i in range(self.__max_arity)]
 
-        return n_buffer
+        for cache in [self.__sum,self.__contains,self.__lencontains]:
+            cache.clear()
 
-    def __empty_buffer(self,n_buffer):
+        self.__joined = {}
 
-        while n_buffer[0]!="":
-            n_buffer = n_buffer[1:] + [""]
-            for i in range(self.__max_arity):
-                self.__ngrams[i][tuple([w for w in n_buffer[self.__max_arity-i-1:]])] += 1
+        # the count of counts of a table is made by its first n(), a table
+        # mapped in memory is not read here
+        for table in self.__tables:
+            self.metrics.gauge("ngrams.order.%i" % table.order,len(table))
 
-        return n_buffer
+        # to calculate and store __len and __nlen
+        len(self)
 
-    def build(self,lines,clean_str=u'[!"%&\'\(\)\+,‚‘’\.\/:;=?\[\]«»¡£§²´µ·¸º°…“”•„−–—]',del_lines=False):
+    def build(self,lines,clean_str=CLEAN_STR,del_lines=False,
+              max_memory=None,tmp_dir=None,workers=None,tokenizer=None):
         """
             Arguments:
                 
-                lines: the lines to build the n-grams
+                lines: the lines to build the n-grams, any iterable of unicode lines
+                    (a list, a generator from pipe, ...). It is read only once.
                 clean_str: a regular expression to clean the strings (default removes every special characters)
+                del_lines: empty the list of lines once it is read (default False)
+                max_memory: approximate number of bytes the counts can take before they
+                    are spilled to sorted runs on disk and merged at the end (default None, no limit)
+                tmp_dir: the directory of the runs (default the system temporary directory)
+                workers: the number of processes counting chunks of lines in parallel
+                    (default None, the lines are counted in this process)
+                tokenizer: the Tokenizer splitting the lines in words
+                    (default Tokenizer(clean_str))
 
             Example:
 
                 ngrams = nGrams(3)
                 ngrams.build([u"C'est un test bien simple",u"Ça ne fait pas beaucoup de mots","est ce bien?"])
+
+                ngrams.build(pipe.iter_text_lines("data/train.fr"),max_memory=2**30,workers=32)
         """
 
         self.__len = 0
         self.__nlen = [0 for i in range(self.__max_arity)]
 
         sys.stderr.write("Building the %i-grams...\n" % self.__max_arity)
-        n_lines = len(lines)
-        n_buffer = self.__init_buffer() 
+        n_lines = len(lines) if hasattr(lines,'__len__') else None
+
+        # counts of the n-grams already built are kept
+        counting = [defaultdict(int,table.items()) for table in self.__tables]
+        self.__vocabulary.add(u"")
 
-        t = Timer(n_lines,out=sys.stderr)
-        t.start()
-        for line in lines:
+        runs = [[] for i in range(self.__max_arity)]
+        run_dir = None
 
-            line = line.lower().strip(u'\n')
+        start = time.time()
+        progress = self.metrics.progress("ngrams.build",n_lines)
+        timings = defaultdict(float)
+        if tokenizer is None:
+            tokenizer = Tokenizer(clean_str)
 
-            if clean_str:
-                line = re.sub(clean_str, ' ', line)
+        # the words, the tables and the number of the chunks counted by the
+        # workers, see __count_parallel
+        chunks = []
 
-            n_buffer = self.__init_buffer()
+        if workers and workers > 1:
+            counted = self.__count_parallel(lines,chunks,tokenizer,workers,timings)
+        else:
+            counted = self.__count_serial(lines,counting,tokenizer,timings)
 
-            for word in line.split(" "):
-                word = word.strip(" ")#word.strip("-").strip(" ")
+        done, checked = 0, 0
+        try:
+            for n in counted:
+                progress.update(n)
+                done += n
 
-                if word:
-                    n_buffer = self.__update_buffer(n_buffer,word)
+                if max_memory and done-checked >= MEMORY_CHECK:
+                    checked = done
 
-            self.__empty_buffer(n_buffer)
-                        
-            t.print_update(1)
-            
-            del lines[0]
+                    used = sum(len(counts) for counts in counting)*COUNTING_BYTES + \
+                        sum(table.nbytes() for words, tables, merged in chunks for table in tables)
 
-        sys.stderr.write("Sorting the %i-grams...\n" % self.__max_arity)
+                    if used > max_memory:
+                        if run_dir is None:
+                            import tempfile
+                            run_dir = tempfile.mkdtemp(prefix="ngrams-",dir=tmp_dir)
 
-        len(self)
- 
-        for ng in range(self.__max_arity):
-            self.__sort_keys(ng,(0,ng+1))
+                        sys.stderr.write("Spilling the %i-grams to disk...\n" % self.__max_arity)
+                        self.__spill(counting,runs,run_dir,chunks)
+
+            if del_lines and isinstance(lines,list):
+                del lines[:]
 
-    def __sort_keys(self,ng,wildcard):
+            self.metrics.count("ngrams.lines",done)
+            for name in sorted(timings):
+                self.metrics.record(name,timings[name])
+
+            sys.stderr.write("Sorting the %i-grams...\n" % self.__max_arity)
+
+            with self.metrics.phase("ngrams.sort"):
+                if run_dir is not None:
+                    self.__spill(counting,runs,run_dir,chunks)
+                    self.__merge(runs)
+                elif workers and workers > 1:
+                    self.__merge_chunks(counting,chunks)
+                else:
+                    self.__finalize(counting)
+        finally:
+            if run_dir is not None:
+                import shutil
+                shutil.rmtree(run_dir)
+
+        self.metrics.record("ngrams.build",time.time()-start,lines=done)
+
+    def update(self,lines,**options):
         """
-            ng = i in i-gram
-            wildcard = subset of i-grams 
-                ex : (0,1) in 3-gram (a,b,c) => (a,b)
+            Arguments:
+
+                lines: the new lines, any iterable of unicode lines
+                options: the options of build (clean_str, max_memory, workers, ...)
+
+            Counts the new lines apart and merges their counts in the n-grams
+            (see merge), the n-grams already built are not sorted again
+
+            Examples:
+
+                ngrams.load("model.bin")
+                ngrams.update(pipe.iter_text_lines("data/today.fr"),workers=8)
+                ngrams.save("model.bin")
         """
 
-        sys.stderr.write("Sorting the %i-grams with wildcard (%i,%i)...\n" % (ng+1,wildcard[0],wildcard[1]))
+        other = nGrams(self.__max_arity,self.__min_count,self.metrics)
+        other.build(lines,**options)
+
+        self.merge(other)
+
+    def merge(self,other):
+        """
+            Arguments:
+
+                other: the nGrams to add, of the same maximal arity (the padding
+                    of the lines, hence the counts, depends on it)
+
+            Adds the counts of other to the counts of the n-grams.
+
+            Both vocabularies are sorted, so the ids of both models renumbered
+            in the union of the vocabularies keep the order of their tables:
+            every order is merged in a single pass over the two sorted tables.
+            The continuation statistics of pruned n-grams are dropped.
+
+            Examples:
+
+                ngrams.merge(today)
+        """
+
+        if other.get_max_arity() != self.__max_arity:
+            raise ValueError("can't merge %i-grams in %i-grams" % (other.get_max_arity(),self.__max_arity))
+
+        sys.stderr.write("Merging the %i-grams...\n" % self.__max_arity)
+
+        words = self.__vocabulary.words()
+        other_words = other.get_vocabulary().words()
+
+        vocabulary = Vocabulary(sorted(set(words) | set(other_words)))
+        remaps = [array('i',[vocabulary[word] for word in words]),
+                  array('i',[vocabulary[word] for word in other_words])]
+
+        def renumbered(table,remap):
+            for key, count in table.items():
+                yield tuple([remap[id] for id in key]), count
+
+        sorted_remaps = all(remap[i] < remap[i+1] for remap in remaps for i in range(len(remap)-1))
+
+        tables = []
+        for order in range(1,self.__max_arity+1):
+            runs = [renumbered(self.__tables[order-1],remaps[0]),
+                    renumbered(other.table(order),remaps[1])]
+
+            if sorted_remaps:
+                tables.append(NGramTable.from_sorted(order,merge_runs(runs)))
+            else:
+                # a vocabulary was not sorted, the tables are not either
+                tables.append(NGramTable.from_items(order,merge_runs([sorted(run) for run in runs])))
+
+        self.__vocabulary = vocabulary
+        self.__set_tables(tables)
+
+    def __decode(self,table,row):
+        return self.__vocabulary.decode(table.key(row))
+
+    def __range(self,ngram,wildcard):
+        """
+            Returns:
 
-        self.__sorted_grams[ng][wildcard[0]] = sorted(self.__ngrams[ng].keys(),key=lambda a:a[wildcard[0]:])#wildcard[1]])
-        sys.stderr.write("done.\n")
+                the table of the order of ngram and the range of positions,
+                in its index on wildcard[0], of the n-grams fitting ngram
+        """
+        table = self.__tables[len(ngram)-1]
+        key = self.__vocabulary.encode(ngram[wildcard[0]:wildcard[1]])
 
-    def __get_sorted_grams(self,ng,wildcard):
-        sorted_grams = self.__sorted_grams[ng].get(wildcard[0],None)
-        if not sorted_grams:
-            self.__sort_keys(ng,wildcard)
-            return self.__sorted_grams[ng].get(wildcard[0],None)
+        if key is None:
+            return table, (0,0)
 
-        return sorted_grams
+        return table, table.search(key,wildcard[0])
 
     def __wildcard(self,nt,wildcard):
-        if wildcard[1] <= 0:
-            wildcard = (wildcard[0],wildcard[1]+nt)
+        """
+            Returns (start,stop) with a stop of 0 or less counted from the end
+            of the n-grams. Like before the packed tables, a stop which is
+            still 0 or less is counted from the end again, so (0,-1) on a
+            1-gram fits the 1-gram itself and not every 1-gram.
+        """
+        for i in range(2):
+            if wildcard[1] <= 0:
+                wildcard = (wildcard[0],wildcard[1]+nt)
 
         return wildcard
 
@@ -321,8 +790,30 @@ class nGrams(object):
                 a list of every ngrams of length==len(ngram) that begins with ngram
         """
 
-        i,j = search_range(ngram,self.__get_sorted_grams(len(ngram)-1,(0,len(ngram))))
-        return self.__get_sorted_grams(len(ngram)-1,(0,len(ngram)))[i:j]
+        table = self.__tables[len(ngram)-1]
+
+        if len(ngram) == 1:
+            # the words of the vocabulary are sorted like the 1-grams
+            i,j = search_range(ngram,None,self.__vocabulary.words())
+            i,j = bisect_left(table.columns[0],i), bisect_left(table.columns[0],j)
+            return [self.__decode(table,row) for row in range(i,j)]
+
+        keys, rows = self.__joined_keys(len(ngram))
+        i,j = search_range(ngram,None,keys)
+        return [self.__decode(table,row) for row in rows[i:j]]
+
+    def __joined_keys(self,order):
+        """
+            Returns the sorted joined words of the order-grams and their rows
+        """
+        if order not in self.__joined:
+            table = self.__tables[order-1]
+            grams = _DecodedGrams(table,self.__vocabulary)
+
+            rows = sorted(range(len(table)),key=lambda row:u"".join(grams[row]))
+            self.__joined[order] = ([u"".join(grams[row]) for row in rows],array(COUNT_TYPE,rows))
+
+        return self.__joined[order]
 
     def lencontains(self,ngram,wildcard=(0,0)):
         """
@@ -343,10 +834,17 @@ class nGrams(object):
 
         wildcard = self.__wildcard(len(ngram),wildcard)
         
-        if (ngram,wildcard) not in self.__lencontains:
-            self.__lencontains[(ngram,wildcard)] = len(self.contains(ngram,wildcard))
+        n = self.__lencontains.get((ngram,wildcard))
+        if n is None:
+            n = self.__kept_statistic(ngram,wildcard)
+
+            if n is None:
+                table, (i,j) = self.__range(ngram,wildcard)
+                n = j-i
 
-        return self.__lencontains[(ngram,wildcard)]
+            self.__lencontains[(ngram,wildcard)] = n
+
+        return n
 
     def contains(self,ngram,wildcard=(0,0)):
         """
@@ -365,15 +863,103 @@ class nGrams(object):
                 # list of 2-grams with first word equal to test
         """
 
-        ng = len(ngram)-1
+        table = self.__tables[len(ngram)-1]
+
+        wildcard = self.__wildcard(len(ngram),wildcard)
+
+        bounds = self.__contains.get((ngram,wildcard))
+        if bounds is None:
+            bounds = self.__range(ngram,wildcard)[1]
+            self.__contains[(ngram,wildcard)] = bounds
+
+        i,j = bounds
+        return [self.__decode(table,row) for row in table.rows(i,j,wildcard[0])]
+
+    def get_many(self,ngrams):
+        """
+            Arguments:
+
+                ngrams: a list of ngrams, of any orders
+
+            Returns:
+
+                the list of the counts of the ngrams (like ngrams[ngram] for every ngram)
+
+            The ngrams of every order are sorted and searched together, every
+            search starting where the previous one ended.
+
+            Examples:
+
+                ngrams.get_many([(u"un",u"test"),(u"test",),(u"un",)])
+        """
+
+        return [self.__filter(count) for count in self.__find_many(ngrams,lambda table,row:table.counts[row],0)]
+
+    def lencontains_many(self,ngrams,wildcard=(0,0)):
+        """
+            Arguments:
+
+                ngrams: a list of ngrams, of any orders
+                wildcard: the wildcard to apply on every ngram
+
+            Returns:
+
+                the list of ngrams.lencontains(ngram,wildcard) for every ngram
+
+            Examples:
+
+                ngrams.lencontains_many([(u"",u"test"),(u"",u"un")],(1,0))
+        """
+
+        results = [0]*len(ngrams)
+
+        by_order = defaultdict(list)
+        for position, ngram in enumerate(ngrams):
+            by_order[len(ngram)].append(position)
+
+        for order, positions in by_order.items():
+            table = self.__tables[order-1]
+            start, stop = self.__wildcard(order,wildcard)
+
+            known = []
+            for position in positions:
+                key = self.__vocabulary.encode(ngrams[position][start:stop])
+                if key is not None:
+                    known.append((key,position))
+
+            ranges = table.search_many([key for key, position in known],start)
+            for (key,position), (i,j) in zip(known,ranges):
+                results[position] = j-i
+
+            if self.__statistics is not None:
+                for position in positions:
+                    n = self.__kept_statistic(ngrams[position],(start,stop))
+                    if n is not None:
+                        results[position] = n
+
+        return results
+
+    def __find_many(self,ngrams,value,ifnot):
+        """
+            Returns value(table,row) for the row of every ngram, ifnot for the missing ones
+        """
+
+        results = [ifnot]*len(ngrams)
+
+        by_order = defaultdict(list)
+        for position, ngram in enumerate(ngrams):
+            key = self.__vocabulary.encode(ngram)
+            if key is not None and ngram:
+                by_order[len(ngram)].append((key,position))
 
-        wildcard = self.__wildcard(ng+1,wildcard)
+        for order, items in by_order.items():
+            table = self.__tables[order-1]
 
-        if (ngram,wildcard) not in self.__contains:
-            self.__contains[(ngram,wildcard)] = search_ngram_range(ngram,self.__get_sorted_grams(ng,wildcard),wildcard=wildcard)
+            for (key,position), row in zip(items,table.find_many([key for key, position in items])):
+                if row >= 0:
+                    results[position] = value(table,row)
 
-        i,j = self.__contains[(ngram,wildcard)]
-        return self.__get_sorted_grams(ng,wildcard)[i:j]
+        return results
 
     def __contains__(self,item):
         return self[item]>0
@@ -399,8 +985,9 @@ class nGrams(object):
         """
 
         wildcard = self.__wildcard(nt,wildcard)
+        table = self.__tables[nt-1]
 
-        return self.__get_sorted_grams(nt-1,wildcard)
+        return [self.__decode(table,row) for row in table.rows(0,len(table),wildcard[0])]
 
     def grams_with_count(self,n,c):
         """
@@ -411,18 +998,28 @@ class nGrams(object):
 
             Returns:
 
-                A list of n-grams with count c
+                An iterator over the n-grams with count c, read from the
+                index of the rows sorted on their counts
 
             Examples:
                 
-                ngrams.grams_with_count(2,1)
+                list(ngrams.grams_with_count(2,1))
                 # list of 2-grams with count 1
         """
  
-        if (n,c) not in self.__gwc:
-            self.__gwc[(n,c)] = filter(lambda a:self[a]==c,self.__get_sorted_grams(n-1,(0,n)))
+        table = self.__tables[n-1]
 
-        return self.__gwc[(n,c)]
+        if c == 0:
+            # the counts filtered to 0
+            i, j = table.count_range(0,max(self.__min_count,1))
+        elif c >= self.__min_count:
+            i, j = table.count_range(c,c+1)
+        else:
+            return
+
+        index = table.count_index()
+        for position in range(i,j):
+            yield self.__decode(table,index[position])
 
     def n(self,order,c,plus=False):
         """
@@ -434,7 +1031,9 @@ class nGrams(object):
 
             Returns:
 
-                The number of n-grams of count c (or c>)
+                The number of n-grams of count c (or c>), of the n-grams
+                counted before pruning for c up to binary.COUNT_OF_COUNTS
+                if they were pruned
 
             Examples:
                 
@@ -448,13 +1047,18 @@ class nGrams(object):
         if c <= 0:
             return 0
 
-        if (order,c,plus) not in self.__n:
-            if plus:
-                self.__n[(order,c,plus)] = self.__nlen[order-1] - self.n(order,c-1,True)
-            else:
-                self.__n[(order,c,plus)] = len(self.grams_with_count(order,c))
+        table = self.__tables[order-1]
+
+        if not plus and self.__statistics is not None and c <= binary.COUNT_OF_COUNTS:
+            # the n-grams counted before pruning
+            return self.__statistics['count_of_counts'][order-1][c-1]
+
+        if plus:
+            return table.at_least(max(c,self.__min_count))
+        elif c < self.__min_count:
+            return 0
 
-        return self.__n[(order,c,plus)] 
+        return table.count_of_counts().get(c,0)
 
     def freq(self,ngram):
         """
@@ -502,15 +1106,24 @@ class nGrams(object):
             if wildcard[1] <= 0:
                 wildcard = (wildcard[0],wildcard[1]+len(ngram))
 
-            if (order,ngram,wildcard) not in self.__sum:
-                self.__sum[(order,ngram,wildcard)] = sum([self[w] for w in self.contains(ngram,(0,-1))])
+            total = self.__sum.get((order,ngram,wildcard))
+            if total is None:
+                total = self.__statistic('follow_sum',ngram[:-1])
+
+                if total is None:
+                    table, (i,j) = self.__range(ngram,self.__wildcard(len(ngram),(0,-1)))
+                    total = sum([self.__filter(table.counts[row]) for row in table.rows(i,j)])
+
+                self.__sum[(order,ngram,wildcard)] = total
 
-            return self.__sum[(order,ngram,wildcard)]
+            return total
 
-        if order not in self.__sum:
-            self.__sum[order] = sum(self.counts(order))
+        total = self.__sum.get(order)
+        if total is None:
+            total = sum(self.counts(order))
+            self.__sum[order] = total
 
-        return self.__sum[order]
+        return total
 
     def counts(self,ng):
         """
@@ -528,37 +1141,280 @@ class nGrams(object):
                 # The counts of every 1-grams
         """
 
-        return self.__ngrams[ng].values()
+        return self.__tables[ng-1].counts
+
+    def __find(self,ngram):
+        """
+            Returns:
+
+                the table of the order of ngram and the row of ngram in it (-1 if missing)
+        """
+        table = self.__tables[len(ngram)-1]
+        key = self.__vocabulary.encode(ngram)
+
+        if key is None:
+            return table, -1
+
+        return table, table.find(key)
+
+    def __filter(self,count):
+        if count >= self.__min_count:
+            return count
+        else:
+            return 0
+
+    def continuation_statistics(self):
+        """
+            Returns:
+
+                the continuation statistics of the n-grams (see binary.STATISTICS),
+                a dictionnary of the arrays of every order by name, plus the
+                n(order,c) of every order for c up to binary.COUNT_OF_COUNTS
+                as count_of_counts. They are the ones kept by prune if the
+                n-grams were pruned, else they are computed on the tables.
+
+            Examples:
+
+                statistics = ngrams.continuation_statistics()
+                statistics['follow'][0][ngrams.row((u"un",))]
+                # the number of 2-grams beginning with u"un"
+        """
+        if self.__statistics is not None:
+            return self.__statistics
+
+        statistics = dict((name,[]) for name in binary.STATISTICS)
+        statistics['count_of_counts'] = [array(COUNT_TYPE,[self.n(order,c) for c in range(1,binary.COUNT_OF_COUNTS+1)])
+                                         for order in range(1,self.__max_arity+1)]
+
+        for order in range(1,self.__max_arity):
+            table = self.__tables[order-1]
+            upper = self.__tables[order]
+
+            follow, follow_sum, continuation = array(COUNT_TYPE), array(COUNT_TYPE), array(COUNT_TYPE)
+
+            # the keys are sorted, every search starts where the previous one ended
+            lo_follow, lo_continuation = 0, 0
+            for row in range(len(table)):
+                key = table.key(row)
+
+                i,j = upper.search(key,0,lo_follow)
+                lo_follow = j
+                follow.append(j-i)
+                follow_sum.append(sum([self.__filter(count) for count in upper.counts[i:j]]))
+
+                i,j = upper.search(key,1,lo_continuation)
+                lo_continuation = j
+                continuation.append(j-i)
+
+            statistics['follow'].append(follow)
+            statistics['follow_sum'].append(follow_sum)
+            statistics['continuation'].append(continuation)
+
+            if order+2 <= self.__max_arity:
+                upper = self.__tables[order+1]
+                middle = array(COUNT_TYPE)
+
+                lo = 0
+                for row in range(len(table)):
+                    i,j = upper.search(table.key(row),1,lo)
+                    lo = j
+                    middle.append(j-i)
+
+                statistics['middle'].append(middle)
+
+        return statistics
+
+    def __statistic(self,name,ngram):
+        """
+            Returns the continuation statistic name of ngram kept by prune,
+            None if there is none
+        """
+        if self.__statistics is None or not ngram:
+            return None
+
+        arrays = self.__statistics[name]
+        if len(ngram) > len(arrays):
+            return None
+
+        row = self.row(ngram)
+        if row < 0:
+            return None
+
+        return arrays[len(ngram)-1][row]
+
+    def __kept_statistic(self,ngram,wildcard):
+        """
+            Returns lencontains(ngram,wildcard) kept by prune, None if there is none
+        """
+        if self.__statistics is None:
+            return None
+
+        start, stop = wildcard
+        nt = len(ngram)
+
+        if start == 0 and stop == nt-1:
+            return self.__statistic('follow',ngram[:-1])
+        elif start == 1 and stop == nt:
+            return self.__statistic('continuation',ngram[1:])
+        elif start == 1 and stop == nt-1:
+            return self.__statistic('middle',ngram[1:-1])
+
+        return None
+
+    def prune(self,min_counts):
+        """
+            Arguments:
+
+                min_counts: the minimal count of the n-grams kept, a list with
+                    one count per order (from the 1-grams) or a single count
+
+            Removes the n-grams with a lower count, except the ones beginning
+            or ending a kept (n+1)-gram (the contexts and the lower orders a
+            kept n-gram backs off to).
+
+            Before removing anything, the continuation statistics of the
+            n-grams (see continuation_statistics) are computed with the current
+            minimal count and kept with the n-grams. lencontains, csum and n use
+            them for the patterns of Kneser-Ney (a_*, *_z, *_* and the counts of
+            counts of the discounts), so the language model of the kept n-grams
+            stays the one of all the n-grams.
+
+            Examples:
+
+                ngrams.prune([1,2,2,3])
+                ngrams.save("model.bin",count_bits=16)
+        """
+        if isinstance(min_counts,int):
+            min_counts = [min_counts]*self.__max_arity
+
+        if len(min_counts) != self.__max_arity:
+            raise ValueError("one minimal count per order is needed: %i given for %i orders" % (len(min_counts),self.__max_arity))
+
+        statistics = self.continuation_statistics()
+
+        # from the highest order, so that the prefixes and the suffixes of
+        # the kept n-grams are known to be kept
+        kept = [None]*self.__max_arity
+        for order in range(self.__max_arity,0,-1):
+            table = self.__tables[order-1]
+            keep = [count >= min_counts[order-1] for count in table.counts]
+
+            if order < self.__max_arity:
+                upper = self.__tables[order]
+                for row in range(len(upper)):
+                    if kept[order][row]:
+                        key = upper.key(row)
+                        for subkey in (key[:-1],key[1:]):
+                            subrow = table.find(subkey)
+                            if subrow >= 0:
+                                keep[subrow] = True
+
+            kept[order-1] = keep
+
+        sys.stderr.write("Pruning the %i-grams...\n" % self.__max_arity)
+
+        tables = []
+        rows = []
+        for table, keep in zip(self.__tables,kept):
+            rows.append([row for row in range(len(table)) if keep[row]])
+            tables.append(table.select(rows[-1]))
+
+        pruned = {'count_of_counts': statistics['count_of_counts']}
+        for name in binary.STATISTICS:
+            pruned[name] = [array(COUNT_TYPE,[values[row] for row in rows[order]])
+                            for order, values in enumerate(statistics[name])]
+
+        self.__set_tables(tables,pruned)
 
     def __delitem__(self, ngram):
-        del self.__ngrams[len(ngram)-1][ngram]
+        """
+            Removes the row of ngram from the table of its order, which is
+            copied without it (also if it was loaded from a memory mapped or
+            quantised file), so that it is no more in the wildcard queries
+            (contains, lencontains, ...). The continuation statistics kept by
+            prune lose the row of ngram too.
+
+            Examples:
+
+                del ngrams[(u"un",u"test")]
+        """
+        table, row = self.__find(ngram)
+
+        if row < 0:
+            raise KeyError(ngram)
+
+        rows = [i for i in range(len(table)) if i != row]
+
+        tables = list(self.__tables)
+        tables[len(ngram)-1] = table.select(rows)
+
+        statistics = self.__statistics
+        if statistics is not None:
+            statistics = dict(statistics)
+            for name in binary.STATISTICS:
+                arrays = list(statistics[name])
+                if len(ngram) <= len(arrays):
+                    values = arrays[len(ngram)-1]
+                    arrays[len(ngram)-1] = array(COUNT_TYPE,[values[i] for i in rows])
+                statistics[name] = arrays
+
+        self.__set_tables(tables,statistics)
 
     def __getitem__(self,ngram):
         if len(ngram)-1 > self.__max_arity:
             raise IndexError("gramm must have an arity equal or lower than %i : %i given" % (self.__max_arity,len(ngram)))
 
-        if self.__ngrams[len(ngram)-1].get(ngram,0) >= self.__min_count:
-            return self.__ngrams[len(ngram)-1].get(ngram,0)
-        else:
+        table, row = self.__find(ngram)
+
+        if row < 0:
             return 0
 
+        return self.__filter(table.counts[row])
+
     def __test_file(self,file,mode):
-        if isinstance(file,type("")):
-            file = codecs.open(file,mode,"utf-8")
+        if isinstance(file,str):
+            file = open(file,mode,encoding="utf-8")
         
         return file
 
-    def save(self,file):
+    def __binary_file(self,file):
+        if isinstance(file,str):
+            return binary.is_binary(file)
+
+        return 'b' in getattr(file,'mode','')
+
+    def save(self,file,text=False,count_bits=None):
         """
             Arguments:
                 
-                file: where to save (utf-8 encoding)
+                file: where to save
+                text: save in the former text format (utf-8 encoding) instead
+                    of the binary format (default False)
+                count_bits: quantise the counts of the binary format on 8 or 16 bits
+                    (default None, exact counts), see binary.quantize
+
+            The binary format (see binary.py) has a vocabulary section and,
+            for every order, the sorted columns of ids and the counts. It is
+            loaded without parsing by mapping the file in memory. It also
+            keeps the continuation statistics of pruned n-grams, which the
+            text format loses.
 
             Examples:
                 
                 ngrams.save("myfile")
+                ngrams.save("myfile",count_bits=16)
         """
 
+        with self.metrics.phase("ngrams.save",text=text):
+            self.__save(file,text,count_bits)
+
+    def __save(self,file,text,count_bits):
+        if not text:
+            sys.stderr.write("Saving the %i-grams...\n" % self.__max_arity)
+            binary.write_model(file,self.__vocabulary.words(),self.__tables,
+                               self.__statistics,count_bits)
+            return
+
         file = self.__test_file(file,'w')
         n_word = len(self)
 
@@ -566,47 +1422,54 @@ class nGrams(object):
 
         sys.stderr.write("Saving the %i-grams...\n" % self.__max_arity)
 
-        t = Timer(n_word,out=sys.stderr)
-        t.start()
-        for i in range(self.__max_arity):
-            for word in self.__get_sorted_grams(i,(0,i+1)):
-                buffer += "#".join(word)+"%"+str(self.__ngrams[i][word])+"\n"
+        progress = self.metrics.progress("ngrams.save",n_word)
+        for table in self.__tables:
+            for key, count in table.items():
+                buffer += "#".join(self.__vocabulary.decode(key))+"%"+str(count)+"\n"
 
                 if len(buffer) > 1000:
                     file.write(buffer)
                     buffer = ""
 
-                t.print_update(1)
+                progress.update(1)
 
         file.write(buffer)
         file.close()
 
-    def load(self,file):
+    def load(self,file,use_mmap=True,vocabulary=None):
         """
             Arguments:
                 
-                file: file to build the n-grams
+                file: file to build the n-grams, in the binary or the text format
+                use_mmap: map a binary file in memory (default True). The tables
+                    are then read-only views on the file, shared between the
+                    processes loading it.
+                vocabulary: the Vocabulary of the ids of a binary file saved
+                    without its words, like a shard (default None)
 
             Examples:
                 
                 ngrams.load("myfile")
         """
 
-        file = self.__test_file(file,'r')
-        self.__ngrams = []
-        self.__sorted_grams = []
-        lines = file.readlines()
-        file.close()
-        n_lines = len(lines)
-
-        self.__len = 0
-        self.__nlen = [0 for i in range(self.__max_arity)]
+        with self.metrics.phase("ngrams.load"):
+            self.__load(file,use_mmap,vocabulary)
 
+    def __load(self,file,use_mmap,vocabulary):
         sys.stderr.write("Loading the %i-grams...\n" % self.__max_arity)
 
-        t = Timer(n_lines,out=sys.stderr)
-        t.start()
-        for line in lines:
+        if self.__binary_file(file):
+            words, tables, statistics = binary.read_model(file,self.__max_arity,use_mmap)
+            self.__vocabulary = vocabulary if vocabulary is not None else Vocabulary(words)
+            self.__set_tables(tables,statistics)
+            return
+
+        file = self.__test_file(file,'r')
+        self.__vocabulary = Vocabulary()
+        counting = []
+
+        progress = self.metrics.progress("ngrams.load")
+        for line in file:
             word, count = line.split("%")
             word = word.split("#")
             n_grams = len(word)-1
@@ -614,24 +1477,20 @@ class nGrams(object):
             if n_grams > self.__max_arity-1:
                 break
         
-            while len(self.__ngrams) <= n_grams:
-                self.__ngrams.append({})
-                self.__sorted_grams.append({(0,n_grams+1):[]})
+            while len(counting) <= n_grams:
+                counting.append({})
                 
-            self.__ngrams[n_grams][tuple(word)] = int(count)
-            self.__get_sorted_grams(n_grams,(0,n_grams+1)).append(tuple(word))
+            counting[n_grams][tuple([self.__vocabulary.add(w) for w in word])] = int(count)
             
-            t.print_update(1)
+            progress.update(1)
 
-        self.__max_arity = len(self.__ngrams)
-
-        # to calculate and store __len and __nlen
-        len(self)
+        file.close()
+        self.__finalize(counting)
 
     def print_list(self):
-        for i in range(self.__max_arity):
-            for word in self.__get_sorted_grams(i,(0,i+1)):
-                print "".join(word), self.__ngrams[i][word]
+        for table in self.__tables:
+            for key, count in table.items():
+                print("".join(self.__vocabulary.decode(key)), count)
 
     def len(self,nt=1):
         """
@@ -655,8 +1514,8 @@ class nGrams(object):
         if self.__len:
             return self.__len
 
-        self.__nlen = [len(ngram.keys()) for ngram in self.__ngrams]
-        self.__len = sum([len(ngram.keys()) for ngram in self.__ngrams])
+        self.__nlen = [len(table) for table in self.__tables]
+        self.__len = sum(self.__nlen)
         return self.__len
 
     def __repr__(self):
@@ -666,38 +1525,38 @@ class nGrams(object):
         str = ""
         for i, nlen in enumerate(self.__nlen):
             str += "%i-gramm : %i grams\n" % (i+1,nlen)
-            str += "%i-gramm : %i grams\n" % (i+1,len(self.__get_sorted_grams(i,(0,i+1))))
+            str += "%i-gramm : %i bytes\n" % (i+1,self.__tables[i].nbytes())
         return str
 
 if __name__=="__main__":
     ngram = nGrams(3)
     ngram.build([u"C'est un test bien simple",u"Ça ne fait pas beaucoup de mots","est ce bien?"])
-    print ngram
+    print(ngram)
     ngram.print_list()
-    print "\n\n\n Save ngram"
+    print("\n\n\n Save ngram")
     ngram.save("test_save")
     test = nGrams(3)
     test.load("test_save")
-    print test
+    print(test)
     test.print_list()
 
     a = sorted(["a","b","bcd","c","d","ab","ac","ad","abc","abd","adc","adcb","acd","abcd","abdc"])
     a = [tuple([i]) for i in a]
     i = search_range('ab',a)
-    print i
-    print a
-    print a[i[0]:i[1]]
+    print(i)
+    print(a)
+    print(a[i[0]:i[1]])
 
-    print "\n\n"
+    print("\n\n")
     i = search_range('b',a)
-    print a[i[0]:i[1]]
-    print ngram.begins_with(('e',))
-
-    print ngram.contains(("un","test","bien"),(2,3))
-    print ngram.contains(("est","un","test"),(0,1))
-    print ngram.contains(("C","est","un"),(1,2))
-    print ngram.contains(("C","est","ce"),(1,3))
-    print ngram.contains(("est","ce"),(0,-1))
-    print "Should not resort 2: (0,1)"
-    print ngram.contains(("est","ce"),(0,1))
-    print ngram.grams_with_count(1,2)
+    print(a[i[0]:i[1]])
+    print(ngram.begins_with(('e',)))
+
+    print(ngram.contains(("un","test","bien"),(2,3)))
+    print(ngram.contains(("est","un","test"),(0,1)))
+    print(ngram.contains(("C","est","un"),(1,2)))
+    print(ngram.contains(("C","est","ce"),(1,3)))
+    print(ngram.contains(("est","ce"),(0,-1)))
+    print("Should not resort 2: (0,1)")
+    print(ngram.contains(("est","ce"),(0,1)))
+    print(list(ngram.grams_with_count(1,2)))
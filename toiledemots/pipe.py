@@ -1,35 +1,230 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import codecs
+import glob
+import importlib
 import sys
 import os
 import select
+import itertools
+from .tokenizer import Tokenizer
 
-def fetch_text_lines(filename=None):
+__all__ = ['iter_text_lines', 'iter_line_batches', 'iter_tokenized_lines', 'fetch_text_lines',
+           'detect_encoding', 'open_binary']
+
+# bytes read and decoded at once
+CHUNK_SIZE = 2**20
+
+# bytes the encoding is detected from
+SAMPLE_SIZE = 2**16
+
+# lines of a batch, the size of the chunks of a parallel nGrams.build
+BATCH_LINES = 10000
+
+# first bytes of the compressed files -> the module opening them
+COMPRESSIONS = [(b"\x1f\x8b","gzip"),(b"BZh","bz2"),(b"\xfd7zXZ\x00","lzma")]
+
+BOMS = [(codecs.BOM_UTF8,'utf-8-sig'),(codecs.BOM_UTF16_LE,'utf-16'),(codecs.BOM_UTF16_BE,'utf-16')]
+
+def _latin1_fallback(error):
+    """
+        Decodes the invalid bytes of a utf-8 text as latin1
+    """
+    return error.object[error.start:error.end].decode('latin1'), error.end
+
+codecs.register_error('toiledemots.latin1',_latin1_fallback)
+
+def detect_encoding(sample):
+    """
+        Arguments:
+
+            sample: the first bytes of a text
+
+        Returns:
+
+            the encoding of the text: the one of its byte order mark, else
+            utf-8 if the sample is valid utf-8 (a character cut at its end
+            is ignored), else latin1
     """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample,final=False)
+    except UnicodeDecodeError:
+        return 'latin1'
+
+    return 'utf-8'
+
+def open_binary(filename=None):
     """
+        Arguments:
+
+            filename: a file name, None for stdin
+
+        Returns:
 
-    if (filename and 
-        os.path.exists(filename)):
-        file = open(filename,'r')
-    elif select.select([sys.stdin,],[],[],0.0)[0]:
-        file = sys.stdin
+            a binary file object of the content of filename, decompressed if
+            it is compressed with gzip, bzip2 or xz (whatever its extension)
+    """
+    if filename is None:
+        file = sys.stdin.buffer
+        magic = file.peek(8)[:8]
     else:
-        raise IOError("No data given as input")
+        file = open(filename,'rb')
+        magic = file.read(8)
+        file.close()
+        file = filename
+
+    for prefix, module in COMPRESSIONS:
+        if magic.startswith(prefix):
+            # imported when needed, so that importing the module stays cheap
+            return importlib.import_module(module).open(file,'rb')
+
+    if filename is None:
+        return file
+
+    return open(filename,'rb')
+
+def _filenames(filenames):
+    """
+        Returns the list of files of filenames (a name, a glob or a list of
+        them), [None] for stdin
+    """
+    if filenames is None:
+        if not select.select([sys.stdin,],[],[],0.0)[0]:
+            raise IOError("No data given as input")
+        return [None]
+
+    if isinstance(filenames,str):
+        filenames = [filenames]
+
+    expanded = []
+    for filename in filenames:
+        if os.path.exists(filename):
+            expanded.append(filename)
+            continue
+
+        matches = sorted(glob.glob(filename))
+        if not matches:
+            raise IOError("No such file: %s" % filename)
+        expanded.extend(matches)
+
+    return expanded
+
+def _iter_file_lines(filename,encoding,chunk_size):
+    file = open_binary(filename)
 
     try:
-        return [unicode(line,'utf-8') for line in iter(file.readline,'')]
-    except UnicodeDecodeError as error:
-        return [unicode(line,'latin1') for line in iter(file.readline,'')]
-#    return [line for line in iter(file.readline,'')]
+        chunk = file.read(chunk_size)
+        if encoding is None:
+            encoding = detect_encoding(chunk[:SAMPLE_SIZE])
+
+        # a utf-8 text with a few invalid bytes keeps its lines, the
+        # invalid bytes being read as latin1
+        decoder = codecs.getincrementaldecoder(encoding)(errors='toiledemots.latin1')
+
+        rest = u""
+        while chunk:
+            lines = (rest+decoder.decode(chunk)).split(u"\n")
+            rest = lines.pop()
+
+            for line in lines:
+                yield line+u"\n"
+
+            chunk = file.read(chunk_size)
+
+        rest += decoder.decode(b"",final=True)
+        if rest:
+            yield rest
+    finally:
+        if file is not sys.stdin.buffer:
+            file.close()
+
+def iter_text_lines(filenames=None,encoding=None,chunk_size=CHUNK_SIZE):
+    """
+        Arguments:
+
+            filenames: a file name, a glob (ex: "data/*.fr.gz") or a list of
+                them (default None, stdin)
+            encoding: the encoding of the files (default None, detected from
+                the first bytes of every file, see detect_encoding)
+            chunk_size: the number of bytes read and decoded at once
+
+        Returns:
+
+            a generator over the unicode lines of the files, one after the
+            other (a glob in sorted order). The files compressed with gzip,
+            bzip2 or xz are decompressed. The files are read lazily, so the
+            lines can be given directly to nGrams.build.
+
+        The bytes which are not valid utf-8 in a utf-8 file are decoded as
+        latin1.
+
+        Examples:
+
+            ngrams.build(pipe.iter_text_lines("data/train.fr"))
+            ngrams.build(pipe.iter_text_lines(["data/train.*.fr.gz","data/extra.fr"]))
+    """
+    for filename in _filenames(filenames):
+        for line in _iter_file_lines(filename,encoding,chunk_size):
+            yield line
+
+def iter_line_batches(filenames=None,batch_size=BATCH_LINES,**options):
+    """
+        Arguments:
+
+            filenames: the files, see iter_text_lines
+            batch_size: the number of lines of a batch (default BATCH_LINES,
+                the lines of a chunk of a parallel nGrams.build)
+            options: encoding and chunk_size, see iter_text_lines
+
+        Returns:
+
+            a generator over lists of batch_size lines (less for the last one)
+
+        Examples:
+
+            for batch in pipe.iter_line_batches("data/*.fr.gz"):
+                pool.apply_async(count,(batch,))
+    """
+    lines = iter_text_lines(filenames,**options)
+
+    while True:
+        batch = list(itertools.islice(lines,batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+def iter_tokenized_lines(filename=None,tokenizer=None,batch_size=1000):
+    """
+        Returns a generator over the lists of words of the lines of filename
+        (or of stdin if filename is None), split by tokenizer (default Tokenizer())
+        in batches of batch_size lines.
+    """
+
+    if tokenizer is None:
+        tokenizer = Tokenizer()
+
+    for batch in iter_line_batches(filename,batch_size):
+        for words in tokenizer.tokenize_batch(batch):
+            yield words
+
+def fetch_text_lines(filenames=None,**options):
+    """
+        Returns the list of the lines of iter_text_lines
+    """
 
-#    return [line.strip("\n").decode('windows-1252').encode('utf8') for line in iter(file.readline,'')]
+    return list(iter_text_lines(filenames,**options))
 
 if __name__=="__main__":
     if len(sys.argv) > 1:
-        lines = fetch_text_lines(sys.argv[1])
+        lines = fetch_text_lines(sys.argv[1:])
     else:
         lines = fetch_text_lines()
 
     for i, line in enumerate(lines):
-        print " %i : %s " % (i, line)
+        print(" %i : %s " % (i, line))
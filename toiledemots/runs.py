@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import marshal
+
+__all__ = ['write_run', 'read_run', 'merge_runs']
+
+# number of records marshalled together in a run file
+BLOCK_SIZE = 10000
+
+def write_run(path,items):
+    """
+        Arguments:
+
+            path: the file of the run
+            items: sorted (key, count) pairs, keys being tuples of words
+
+        Writes a sorted run on disk in blocks of marshalled records
+
+        Examples:
+
+            write_run("/tmp/run-0",sorted(counts.items()))
+    """
+    file = open(path,'wb')
+
+    keys, counts = [], []
+    for key, count in items:
+        keys.append(key)
+        counts.append(count)
+
+        if len(keys) >= BLOCK_SIZE:
+            marshal.dump((keys,counts),file)
+            keys, counts = [], []
+
+    if keys:
+        marshal.dump((keys,counts),file)
+
+    file.close()
+
+def read_run(path):
+    """
+        Arguments:
+
+            path: the file of a run written by write_run
+
+        Returns:
+
+            a generator over the (key, count) pairs of the run
+    """
+    file = open(path,'rb')
+
+    try:
+        while True:
+            try:
+                keys, counts = marshal.load(file)
+            except EOFError:
+                return
+
+            for item in zip(keys,counts):
+                yield item
+    finally:
+        file.close()
+
+def merge_runs(runs):
+    """
+        Arguments:
+
+            runs: iterables of sorted (key, count) pairs
+
+        Returns:
+
+            a generator over the sorted (key, count) pairs of all the runs,
+            the counts of equal keys being summed
+
+        Examples:
+
+            merge_runs([read_run("/tmp/run-0"),read_run("/tmp/run-1")])
+    """
+    current, total = None, 0
+
+    for key, count in heapq.merge(*runs):
+        if key == current:
+            total += count
+        else:
+            if current is not None:
+                yield current, total
+            current, total = key, count
+
+    if current is not None:
+        yield current, total
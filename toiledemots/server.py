@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['Batcher', 'serve', 'Client']
+
+DEFAULT_PORT = 8765
+
+# maximal number of queries answered together and maximal time a query
+# waits for others to be batched with it
+BATCH_SIZE = 256
+BATCH_WAIT = 0.005
+
+# maximal length in bytes of a request line
+MAX_LINE = 2**24
+
+# Protocol: one JSON object per line in both directions
+#
+#   request:  {"id": 1, "method": "p", "params": {"ngram": ["un", "test"]}}
+#   response: {"id": 1, "result": 0.25} or {"id": 1, "error": "..."}
+#
+#   methods: p (ngram), score (sentences, log10 probabilities of their words),
+#            perplexity (sentences), closests (word, k, max_dist, min_score, by_frequency)
+#
+#   JSON has no infinity: a score of -inf (a word of probability 0) and a
+#   perplexity of inf are sent as null
+
+class _Query(object):
+    def __init__(self,method,params):
+        self.method = method
+        self.params = params
+        self.result = None
+        self.error = None
+
+class Batcher(object):
+    """
+        Answers the queries of concurrent connections in batches
+
+        Arguments:
+
+            lm: the LanguageModel answering p, score and perplexity (default None)
+            toile: the Toile answering closests (default None)
+            batch_size: the maximal number of queries answered together (default 256)
+            wait: the maximal time in seconds a query waits for others (default 0.005)
+            workers: the number of processes of Toile.get_closests_many, forked
+                once when the Batcher is created (default None)
+
+        The queries are submitted from the coroutines of an asyncio event loop.
+        The queries waiting together are answered by answer in a single thread
+        apart from the loop, so that the loop keeps reading the connections
+        meanwhile: they are grouped by method, the n-grams asked more than once
+        are computed once, the sentences of every query are scored in one call
+        of score_sentences and the words of every query in one call of
+        get_closests_many.
+
+        Examples:
+
+            batcher = Batcher(lm,toile)
+            await batcher.submit("p",{"ngram":[u"un",u"test"]})
+            batcher.close()
+    """
+
+    def __init__(self,lm=None,toile=None,batch_size=BATCH_SIZE,wait=BATCH_WAIT,workers=None):
+        self.lm = lm
+        self.toile = toile
+        self.batch_size = batch_size
+        self.wait = wait
+
+        # forked before any thread is started
+        self.pool = None
+        if toile is not None and workers and workers > 1:
+            self.pool = toile.pool(workers)
+
+        self.__executor = ThreadPoolExecutor(1)
+        self.__queue = None
+        self.__task = None
+
+    async def submit(self,method,params):
+        """
+            Returns:
+
+                the result of the query, once its batch is answered
+        """
+        if self.__task is None:
+            self.__queue = asyncio.Queue()
+            self.__task = asyncio.ensure_future(self.__run())
+
+        query = _Query(method,params)
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put_nowait((query,future))
+
+        await future
+
+        if query.error is not None:
+            raise query.error
+
+        return query.result
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.__queue.get()]
+            deadline = loop.time() + self.wait
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.__queue.get(),timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await loop.run_in_executor(self.__executor,self.answer,[query for query, future in batch])
+            except Exception as e:
+                for query, future in batch:
+                    query.error = e
+
+            for query, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self):
+        """
+            Stops the thread answering the queries and the workers of closests
+        """
+        self.__executor.shutdown()
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def answer(self,batch):
+        """
+            Answers a batch of queries
+        """
+        by_method = defaultdict(list)
+        for query in batch:
+            by_method[query.method].append(query)
+
+        for method, queries in by_method.items():
+            try:
+                self.__answer(method,queries)
+            except Exception as e:
+                if len(queries) == 1:
+                    queries[0].error = e
+                else:
+                    # answered one by one, so that only the wrong queries fail
+                    for query in queries:
+                        try:
+                            self.__answer(method,[query])
+                        except Exception as e:
+                            query.error = e
+
+    def __answer(self,method,queries):
+        answer = getattr(self,"_answer_%s" % method,None)
+        if answer is None:
+            raise ValueError("unknown method %s" % method)
+
+        answer(queries)
+
+    def __model(self,name):
+        model = getattr(self,name)
+        if model is None:
+            raise ValueError("the server has no %s" % ("language model" if name == "lm" else name))
+
+        return model
+
+    def _answer_p(self,queries):
+        lm = self.__model("lm")
+
+        probabilities = {}
+        for query in queries:
+            ngram = tuple(query.params["ngram"])
+            if not ngram:
+                query.error = ValueError("empty n-gram")
+                continue
+
+            if ngram not in probabilities:
+                probabilities[ngram] = lm.p(ngram)
+
+            query.result = probabilities[ngram]
+
+    def __scores(self,queries):
+        """
+            Returns the scores of the sentences of every query, all the
+            sentences being scored together
+        """
+        lm = self.__model("lm")
+
+        sentences = []
+        for query in queries:
+            sentences.extend(query.params["sentences"])
+
+        scores = lm.score_sentences(sentences)
+
+        return [[list(next(scores)) for sentence in query.params["sentences"]] for query in queries]
+
+    def _answer_score(self,queries):
+        for query, scores in zip(queries,self.__scores(queries)):
+            query.result = scores
+
+    def _answer_perplexity(self,queries):
+        for query, scores in zip(queries,self.__scores(queries)):
+            total = sum(sum(sentence) for sentence in scores)
+            n = sum(len(sentence) for sentence in scores)
+
+            try:
+                query.result = 10**(-total/n)
+            except ZeroDivisionError as e:
+                query.result = 0.0
+
+    def _answer_closests(self,queries):
+        toile = self.__model("toile")
+
+        # the queries with the same options are searched together
+        by_options = defaultdict(list)
+        for query in queries:
+            params = dict(query.params)
+            word = params.pop("word")
+            by_options[tuple(sorted(params.items()))].append((word,query))
+
+        for options, items in by_options.items():
+            options = dict(options)
+            k = options.pop("k",None)
+
+            results = toile.get_closests_many([word for word, query in items],k,pool=self.pool,**options)
+            for (word,query), closests in zip(items,results):
+                query.result = closests
+
+def _finite(result):
+    """
+        Returns result with its floats which are not finite replaced by None
+    """
+    if isinstance(result,float):
+        return result if math.isfinite(result) else None
+    elif isinstance(result,(list,tuple)):
+        return [_finite(item) for item in result]
+
+    return result
+
+def _encode(response):
+    """
+        Returns the line of response, an error if it is not valid JSON
+    """
+    try:
+        return json.dumps(response,allow_nan=False)+"\n"
+    except ValueError as e:
+        return json.dumps({"id":response["id"],"error":"%s: %s" % (e.__class__.__name__,e)})+"\n"
+
+async def _handle(batcher,reader,writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+
+            id = None
+            try:
+                request = json.loads(line)
+                id = request.get("id")
+                result = await batcher.submit(request["method"],request.get("params",{}))
+                response = {"id":id,"result":_finite(result)}
+            except Exception as e:
+                response = {"id":id,"error":"%s: %s" % (e.__class__.__name__,e)}
+
+            writer.write(_encode(response).encode("utf-8"))
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def _serve(batcher,path,host,port):
+    def handle(reader,writer):
+        return _handle(batcher,reader,writer)
+
+    if path is not None:
+        server = await asyncio.start_unix_server(handle,path,limit=MAX_LINE)
+        address = path
+    else:
+        server = await asyncio.start_server(handle,host,port,limit=MAX_LINE)
+        address = "%s:%i" % server.sockets[0].getsockname()[:2]
+
+    sys.stderr.write("Serving on %s...\n" % address)
+
+    async with server:
+        await server.serve_forever()
+
+def serve(lm=None,toile=None,path=None,host="127.0.0.1",port=DEFAULT_PORT,**options):
+    """
+        Arguments:
+
+            lm: the LanguageModel to serve (default None)
+            toile: the Toile to serve (default None)
+            path: the Unix socket to listen to (default None, listens to host:port)
+            host, port: the address to listen to (default 127.0.0.1:8765)
+            options: the options of the Batcher (batch_size, wait, workers)
+
+        Answers the queries of every connection until interrupted, the
+        connections being read by an asyncio event loop and their queries
+        batched by a Batcher
+
+        Examples:
+
+            serve(LanguageModel(ngrams),toile,path="/tmp/toiledemots.sock")
+    """
+    if path is not None and os.path.exists(path):
+        os.unlink(path)
+
+    batcher = Batcher(lm,toile,**options)
+
+    try:
+        asyncio.run(_serve(batcher,path,host,port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.close()
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+
+class Client(object):
+    """
+        Client of a server
+
+        Arguments:
+
+            path: the Unix socket of the server (default None, connects to host:port)
+            host, port: the address of the server (default 127.0.0.1:8765)
+
+        Examples:
+
+            client = Client(path="/tmp/toiledemots.sock")
+            client.p((u"un",u"test"))
+            client.perplexity([u"C'est un test"])
+            client.closests(u"ciel",20)
+    """
+
+    def __init__(self,path=None,host="127.0.0.1",port=DEFAULT_PORT):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host,port))
+
+        self.file = self.socket.makefile('rb')
+        self.__id = 0
+
+    def call(self,method,**params):
+        self.__id += 1
+        self.socket.sendall((json.dumps({"id":self.__id,"method":method,"params":params})+"\n").encode("utf-8"))
+
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+
+        return response["result"]
+
+    def p(self,ngram):
+        return self.call("p",ngram=list(ngram))
+
+    def score(self,sentences):
+        return [[float('-inf') if score is None else score for score in scores]
+                for scores in self.call("score",sentences=list(sentences))]
+
+    def perplexity(self,sentences):
+        perplexity = self.call("perplexity",sentences=list(sentences))
+        return float('inf') if perplexity is None else perplexity
+
+    def closests(self,word,k=None,**options):
+        options["word"] = word
+        options["k"] = k
+        return [tuple(closest) for closest in self.call("closests",**options)]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
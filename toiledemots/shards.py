@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+import marshal
+import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from . import binary
+from .cache import Cache
+from .metrics import get_metrics
+from .ngrams import nGrams
+from .table import NGramTable, ID_TYPE, COUNT_TYPE
+from .vocabulary import Vocabulary
+
+__all__ = ['write_shards', 'ShardedNGrams']
+
+MAGIC = "TDMSHARD"
+VERSION = 1
+
+# number of shards mapped in memory at once by default
+MAX_OPEN = 8
+
+# Layout of a sharded model (a directory)
+#
+#   manifest: a marshalled record of the maximal arity, the minimal count,
+#             the first word id of every shard, and for every order the
+#             number of n-grams, the sum of their counts, their count of
+#             counts and the n(order,c) of the statistics
+#   vocabulary: a binary model without orders, the words of every shard
+#   shard-00000, ...: binary models without words, the n-grams of every
+#             order whose first word id is in the range of the shard, with
+#             the continuation statistics of the whole model
+
+def _resolved(ngram,wildcard):
+    """
+        Returns (start,stop) of wildcard on ngram, like nGrams does
+    """
+    start, stop = wildcard
+    for i in range(2):
+        if stop <= 0:
+            stop += len(ngram)
+
+    return start, stop
+
+def _shard_file(directory,shard):
+    return os.path.join(directory,"shard-%05i" % shard)
+
+def _bounds(tables,n_words,n_shards):
+    """
+        Returns the first word id of every shard, so that the shards have
+        about the same number of n-grams
+    """
+    weights = array(COUNT_TYPE,[0])*n_words
+    for table in tables:
+        for id in table.columns[0]:
+            weights[id] += 1
+
+    total = sum(weights)
+    bounds = [0]
+    done = 0
+    for id, weight in enumerate(weights):
+        if done >= total*len(bounds)/float(n_shards) and len(bounds) < n_shards:
+            bounds.append(id)
+        done += weight
+
+    return bounds
+
+def write_shards(directory,ngrams,n_shards):
+    """
+        Arguments:
+
+            directory: the directory of the shards (created if needed)
+            ngrams: the nGrams to split, a model mapped in memory from a
+                binary file does not need to fit in memory
+            n_shards: the number of shards
+
+        Splits the n-grams of every order in ranges of their first word id.
+        The tables being sorted on the ids, every shard is a slice of them.
+
+        Examples:
+
+            ngrams = nGrams(5)
+            ngrams.load("model.bin")
+            write_shards("model.shards",ngrams,64)
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    max_arity = ngrams.get_max_arity()
+    tables = [ngrams.table(order) for order in range(1,max_arity+1)]
+    words = ngrams.get_vocabulary().words()
+    statistics = ngrams.continuation_statistics()
+
+    bounds = _bounds(tables,len(words),n_shards)
+
+    sys.stderr.write("Writing %i shards of the %i-grams...\n" % (len(bounds),max_arity))
+
+    for shard, first in enumerate(bounds):
+        last = bounds[shard+1] if shard+1 < len(bounds) else len(words)
+
+        shard_tables = []
+        shard_statistics = {'count_of_counts': statistics['count_of_counts']}
+        for name in binary.STATISTICS:
+            shard_statistics[name] = []
+
+        for order, table in enumerate(tables,1):
+            i = bisect_left(table.columns[0],first)
+            j = bisect_left(table.columns[0],last,i)
+
+            columns = [array(ID_TYPE,column[i:j]) for column in table.columns]
+            shard_tables.append(NGramTable(order,columns,array(COUNT_TYPE,table.counts[i:j])))
+
+            for name in binary.STATISTICS:
+                if order <= len(statistics[name]):
+                    shard_statistics[name].append(array(COUNT_TYPE,statistics[name][order-1][i:j]))
+
+        binary.write_model(_shard_file(directory,shard),[],shard_tables,shard_statistics)
+
+    binary.write_model(os.path.join(directory,"vocabulary"),words,[])
+
+    manifest = (MAGIC,VERSION,max_arity,ngrams.get_minimal_count(),bounds,
+                [len(table) for table in tables],
+                [sum(table.counts) for table in tables],
+                [table.count_of_counts() for table in tables],
+                [list(counts) for counts in statistics['count_of_counts']])
+
+    file = open(os.path.join(directory,"manifest"),'wb')
+    marshal.dump(manifest,file)
+    file.close()
+
+class ShardedNGrams(object):
+    """
+        n-grams split in shards on disk (see write_shards)
+
+        Arguments:
+
+            directory: the directory of the shards
+            max_open: the maximal number of shards open at once (default 8)
+            use_mmap: map the shards in memory (default True)
+            metrics: the Metrics of the shards and of their cache
+                (default metrics.get_metrics())
+
+        Answers the queries of nGrams used by the uncompiled language models
+        (getitem, lencontains, csum, n and freq) by opening only the shard of
+        the first word the query is about. The shards are loaded as nGrams
+        when first needed and kept in a least recently used cache.
+
+        The continuation statistics of the whole model are kept in the shards,
+        so the n-grams ending with a word (wildcard (1,0) or (1,-1)) are counted
+        by the shard of this word alone. The other wildcards starting after
+        the first word, in lencontains and in contains, go through every
+        shard. The minimal count is the one of the nGrams written.
+
+        A LanguageModel of sharded n-grams is not compiled: compile would
+        keep statistics for every n-gram of every shard in memory.
+
+        Examples:
+
+            write_shards("model.shards",ngrams,64)
+
+            ngrams = ShardedNGrams("model.shards",max_open=4)
+            ngrams[(u"un",u"test")]
+            lm = KneserNey.LanguageModel(ngrams)
+            lm.p((u"un",u"test"))
+    """
+
+    def __init__(self,directory,max_open=MAX_OPEN,use_mmap=True,metrics=None):
+        self.directory = directory
+        self.use_mmap = use_mmap
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+        file = open(os.path.join(directory,"manifest"),'rb')
+        manifest = marshal.load(file)
+        file.close()
+
+        if manifest[0] != MAGIC:
+            raise ValueError("not a sharded n-gram model")
+        if manifest[1] != VERSION:
+            raise ValueError("unsupported sharded n-gram model version %i" % manifest[1])
+
+        magic, version, self.__max_arity, self.__min_count, self.__bounds, \
+            self.__lengths, self.__sums, self.__count_of_counts, self.__kept = manifest
+
+        words, tables, statistics = binary.read_model(os.path.join(directory,"vocabulary"),use_mmap=False)
+        self.__vocabulary = Vocabulary(words)
+
+        self.__shards = Cache(max_open)
+        self.metrics.watch("shards.open",self.__shards)
+
+        # the shards are never changed, see nGrams.version
+        self.version = 0
+
+    def get_max_arity(self):
+        return self.__max_arity
+
+    def get_vocabulary(self):
+        return self.__vocabulary
+
+    def get_minimal_count(self):
+        return self.__min_count
+
+    def shard(self,shard):
+        """
+            Returns:
+
+                the nGrams of a shard, loaded if it is not open
+        """
+        ngrams = self.__shards.get(shard)
+
+        if ngrams is None:
+            ngrams = nGrams(self.__max_arity,self.__min_count,self.metrics)
+            ngrams.load(_shard_file(self.directory,shard),self.use_mmap,self.__vocabulary)
+            self.__shards[shard] = ngrams
+
+        return ngrams
+
+    def __word_shard(self,word):
+        """
+            Returns the nGrams of the shard of word, None if word is unknown
+        """
+        id = self.__vocabulary.get(word)
+
+        if id is None:
+            return None
+
+        return self.shard(bisect_right(self.__bounds,id)-1)
+
+    def __all_shards(self):
+        for shard in range(len(self.__bounds)):
+            yield self.shard(shard)
+
+    def __getitem__(self,ngram):
+        if len(ngram)-1 > self.__max_arity:
+            raise IndexError("gramm must have an arity equal or lower than %i : %i given" % (self.__max_arity,len(ngram)))
+
+        if not ngram:
+            return 0
+
+        ngrams = self.__word_shard(ngram[0])
+
+        if ngrams is None:
+            return 0
+
+        return ngrams[ngram]
+
+    def __contains__(self,item):
+        return self[item]>0
+
+    def __first_word(self,ngram,wildcard):
+        """
+            Returns the position of the word whose shard answers lencontains
+            of ngram with wildcard, None if every shard must
+        """
+        start, stop = _resolved(ngram,wildcard)
+
+        if start >= stop:
+            return None
+        elif start == 0:
+            return 0
+        elif start == 1 and stop >= len(ngram)-1:
+            # kept by the statistics of the shard of ngram[1:] or ngram[1:-1]
+            return 1
+
+        return None
+
+    def lencontains(self,ngram,wildcard=(0,0)):
+        """
+            See nGrams.lencontains
+        """
+        position = self.__first_word(ngram,wildcard)
+
+        if position is None:
+            return sum(ngrams.lencontains(ngram,wildcard) for ngrams in self.__all_shards())
+
+        ngrams = self.__word_shard(ngram[position])
+
+        if ngrams is None:
+            return 0
+
+        return ngrams.lencontains(ngram,wildcard)
+
+    def contains(self,ngram,wildcard=(0,0)):
+        """
+            See nGrams.contains, the n-grams of every shard follow each other
+            when the first word of ngram is a wildcard
+        """
+        start, stop = _resolved(ngram,wildcard)
+
+        if start == 0 and stop > 0:
+            ngrams = self.__word_shard(ngram[0])
+            return ngrams.contains(ngram,wildcard) if ngrams is not None else []
+
+        grams = []
+        for ngrams in self.__all_shards():
+            grams.extend(ngrams.contains(ngram,wildcard))
+
+        return grams
+
+    def csum(self,order,ngram=None,wildcard=(0,0)):
+        """
+            See nGrams.csum
+        """
+        if not ngram:
+            return self.__sums[order-1]
+
+        # the n-grams beginning like ngram, so in the shard of its first word
+        ngrams = self.__word_shard(ngram[0])
+
+        if ngrams is None:
+            return 0
+
+        return ngrams.csum(order,ngram,wildcard)
+
+    def continuation_statistics(self):
+        """
+            Raises a ValueError: the statistics of every n-gram are kept in
+            the shards only, so a LanguageModel of ShardedNGrams is not compiled
+        """
+        raise ValueError("a LanguageModel of ShardedNGrams cannot be compiled, "
+                         "the statistics of every n-gram are kept in the shards only")
+
+    def n(self,order,c,plus=False):
+        """
+            See nGrams.n
+        """
+        if c <= 0:
+            return 0
+
+        if not plus and c <= binary.COUNT_OF_COUNTS:
+            # the ones of the written nGrams, which were kept if it was pruned
+            return self.__kept[order-1][c-1]
+
+        count_of_counts = self.__count_of_counts[order-1]
+
+        if plus:
+            c = max(c,self.__min_count)
+            return sum(n for count, n in count_of_counts.items() if count >= c)
+        elif c < self.__min_count:
+            return 0
+
+        return count_of_counts.get(c,0)
+
+    def freq(self,ngram):
+        """
+            See nGrams.freq
+        """
+        return self[ngram]/float(self.csum(len(ngram)))
+
+    def getgrams(self,nt):
+        """
+            Returns:
+
+                the list of every nt-gram, sorted
+        """
+        grams = []
+        for ngrams in self.__all_shards():
+            grams.extend(ngrams.getgrams(nt))
+
+        return grams
+
+    def len(self,nt=1):
+        return self.__lengths[nt-1]
+
+    def __len__(self):
+        return sum(self.__lengths)
+
+    def __str__(self):
+        return "%i-grams in %i shards (%s)" % (self.__max_arity,len(self.__bounds),self.directory)
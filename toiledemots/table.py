@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+__all__ = ['NGramTable', 'QuantizedColumn']
+
+# typecodes of the packed columns
+ID_TYPE = 'i'
+COUNT_TYPE = 'l'
+
+class _PermutedColumn(object):
+    """
+        Read-only view of a column in the order of a permutation of its rows
+    """
+
+    def __init__(self,column,permutation):
+        self.column = column
+        self.permutation = permutation
+
+    def __len__(self):
+        return len(self.permutation)
+
+    def __getitem__(self,i):
+        return self.column[self.permutation[i]]
+
+class QuantizedColumn(object):
+    """
+        Read-only column of counts stored as codes in a codebook
+
+        Arguments:
+
+            codes: an array of 8 or 16 bits codes, one per row
+            codebook: the array of the counts of every code
+    """
+
+    def __init__(self,codes,codebook):
+        self.codes = codes
+        self.codebook = codebook
+        self.itemsize = codes.itemsize
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self.codebook[code] for code in self.codes[i]]
+
+        return self.codebook[self.codes[i]]
+
+    def __iter__(self):
+        codebook = self.codebook
+        for code in self.codes:
+            yield codebook[code]
+
+class NGramTable(object):
+    """
+        Packed table of n-grams of a single order
+
+        Arguments:
+
+            order: the order of the n-grams (n)
+            columns: one array of word ids per position in the n-grams
+            counts: the array of counts
+
+        The n-grams are stored as columns of word ids plus a column of counts,
+        sorted on the ids. A row index is the id of an n-gram in its order.
+
+        To search the n-grams on their words from a given position (an offset),
+        the table keeps one index per offset: the array of the rows sorted on
+        the ids from this position. The indexes are built when first needed.
+
+        The table also keeps the count of counts (the number of rows of every
+        count) and, when first needed, an index of the rows sorted on their
+        counts. The counts must then be changed with set_count.
+
+        Examples:
+
+            table = NGramTable.from_items(2,{(0,1):3,(1,2):1})
+            table.find((0,1))
+            table.key(0)
+            table.counts[0]
+
+            i, j = table.search((2,),offset=1)
+            table.rows(i,j,offset=1)
+    """
+
+    def __init__(self,order,columns=None,counts=None):
+        self.order = order
+
+        if columns is None:
+            columns = [array(ID_TYPE) for i in range(order)]
+        if counts is None:
+            counts = array(COUNT_TYPE)
+
+        self.columns = columns
+        self.counts = counts
+
+        self.__indexes = {}
+        self.__count_of_counts = None
+        self.__count_index = None
+        self.__at_least = None
+
+    @classmethod
+    def from_items(cls,order,items,remap=None):
+        """
+            Arguments:
+
+                order: the order of the n-grams
+                items: (tuple of ids, count) pairs or a dictionnary, in any order
+                remap: an array mapping the ids of the items to new ids (default None)
+
+            Returns:
+
+                a sorted NGramTable
+        """
+        if isinstance(items,dict):
+            items = items.items()
+
+        if remap is not None:
+            items = [(tuple([remap[id] for id in key]),count) for key, count in items]
+        else:
+            items = list(items)
+
+        items.sort()
+
+        return cls.from_sorted(order,items)
+
+    @classmethod
+    def from_sorted(cls,order,items):
+        """
+            Arguments:
+
+                order: the order of the n-grams
+                items: (tuple of ids, count) pairs already sorted on the ids,
+                    any iterable (it is consumed only once)
+
+            Returns:
+
+                an NGramTable
+        """
+        table = cls(order)
+        count_of_counts = defaultdict(int)
+
+        for key, count in items:
+            for column, id in zip(table.columns,key):
+                column.append(id)
+            table.counts.append(count)
+            count_of_counts[count] += 1
+
+        table.__count_of_counts = dict(count_of_counts)
+
+        return table
+
+    def __len__(self):
+        return len(self.counts)
+
+    def select(self,rows):
+        """
+            Arguments:
+
+                rows: the rows to keep, in increasing order
+
+            Returns:
+
+                a new NGramTable of the n-grams at rows
+        """
+        columns = [array(ID_TYPE,[column[row] for row in rows]) for column in self.columns]
+        counts = array(COUNT_TYPE,[self.counts[row] for row in rows])
+
+        return NGramTable(self.order,columns,counts)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.key(row)
+
+    def key(self,row):
+        """
+            Returns:
+
+                the tuple of ids of the n-gram at row
+        """
+        return tuple([column[row] for column in self.columns])
+
+    def items(self):
+        for row in range(len(self)):
+            yield self.key(row), self.counts[row]
+
+    def index(self,offset):
+        """
+            Arguments:
+
+                offset: the position of the first word the rows are sorted on
+
+            Returns:
+
+                the array of the rows sorted on their ids from offset (the
+                ties stay sorted on the whole n-grams), None for offset 0
+        """
+        if offset == 0:
+            return None
+
+        permutation = self.__indexes.get(offset)
+
+        if permutation is None:
+            # stable sorts from the last position to offset
+            rows = list(range(len(self)))
+            for column in reversed(self.columns[offset:]):
+                rows.sort(key=column.__getitem__)
+
+            permutation = array(COUNT_TYPE,rows)
+            self.__indexes[offset] = permutation
+
+        return permutation
+
+    def search(self,key,offset=0,lo=0):
+        """
+            Arguments:
+
+                key: a tuple of ids, not longer than order-offset
+                offset: the position of the first word of key in the n-grams
+                lo: the first position to search from (default 0)
+
+            Returns:
+
+                (i,j) the range of positions, in the index on offset, of the
+                n-grams having the ids of key from offset
+
+            Examples:
+
+                table.search((4,),offset=2)
+                # the 3-grams ending with the word 4
+        """
+        hi = len(self)
+
+        columns = self.columns[offset:]
+        if offset:
+            permutation = self.index(offset)
+            columns = [_PermutedColumn(column,permutation) for column in columns]
+
+        for column, id in zip(columns,key):
+            lo = bisect_left(column,id,lo,hi)
+            hi = bisect_right(column,id,lo,hi)
+
+            if lo == hi:
+                break
+
+        return lo, hi
+
+    def search_many(self,keys,offset=0):
+        """
+            Arguments:
+
+                keys: a list of tuples of ids, all of the same length
+                offset: the position of the first word of the keys in the n-grams
+
+            Returns:
+
+                the list of the ranges (i,j) of every key, see search
+
+            The keys are searched in sorted order, every search starting
+            where the previous one ended.
+        """
+        results = [None]*len(keys)
+
+        columns = self.columns[offset:]
+        if offset:
+            permutation = self.index(offset)
+            columns = [_PermutedColumn(column,permutation) for column in columns]
+
+        start = 0
+        for position in sorted(range(len(keys)),key=keys.__getitem__):
+            lo, hi = start, len(self)
+
+            for column, id in zip(columns,keys[position]):
+                lo = bisect_left(column,id,lo,hi)
+                hi = bisect_right(column,id,lo,hi)
+
+                if lo == hi:
+                    break
+
+            start = lo
+            results[position] = (lo,hi)
+
+        return results
+
+    def find_many(self,keys):
+        """
+            Arguments:
+
+                keys: a list of tuples of ids of length order
+
+            Returns:
+
+                the list of the rows of the keys, -1 for the missing ones
+        """
+        rows = []
+        for key, (i,j) in zip(keys,self.search_many(keys)):
+            if i == j or len(key) != self.order:
+                rows.append(-1)
+            else:
+                rows.append(i)
+
+        return rows
+
+    def rows(self,i,j,offset=0):
+        """
+            Returns:
+
+                the rows at the positions i to j of the index on offset
+        """
+        if offset == 0:
+            return range(i,j)
+
+        return self.index(offset)[i:j]
+
+    def find(self,key):
+        """
+            Arguments:
+
+                key: a tuple of ids of length order
+
+            Returns:
+
+                the row of the n-gram, -1 if it is not in the table
+        """
+        if len(key) != self.order:
+            return -1
+
+        i, j = self.search(key)
+
+        if i == j:
+            return -1
+
+        return i
+
+    def get(self,key,ifnot=0):
+        """
+            Returns:
+
+                the count of the n-gram with the given ids, ifnot if it is not in the table
+        """
+        row = self.find(key)
+
+        if row < 0:
+            return ifnot
+
+        return self.counts[row]
+
+    def set_count(self,row,count):
+        """
+            Sets the count of the n-gram at row, updating the count of counts
+        """
+        count_of_counts = self.count_of_counts()
+
+        old = self.counts[row]
+        count_of_counts[old] -= 1
+        if not count_of_counts[old]:
+            del count_of_counts[old]
+        count_of_counts[count] = count_of_counts.get(count,0) + 1
+
+        self.counts[row] = count
+
+        self.__count_index = None
+        self.__at_least = None
+
+    def count_of_counts(self):
+        """
+            Returns:
+
+                a dictionnary of the number of rows of every count
+        """
+        if self.__count_of_counts is None:
+            count_of_counts = defaultdict(int)
+            for count in self.counts:
+                count_of_counts[count] += 1
+
+            self.__count_of_counts = dict(count_of_counts)
+
+        return self.__count_of_counts
+
+    def at_least(self,count):
+        """
+            Returns:
+
+                the number of rows with a count of count or more
+        """
+        if self.__at_least is None:
+            # the distinct counts and the number of rows from each of them
+            counts = sorted(self.count_of_counts())
+            totals = [0]*(len(counts)+1)
+            for i in range(len(counts)-1,-1,-1):
+                totals[i] = totals[i+1] + self.__count_of_counts[counts[i]]
+
+            self.__at_least = (counts,totals)
+
+        counts, totals = self.__at_least
+
+        return totals[bisect_left(counts,count)]
+
+    def count_index(self):
+        """
+            Returns:
+
+                the array of the rows sorted on their counts (the ties stay
+                sorted on the n-grams)
+        """
+        if self.__count_index is None:
+            rows = sorted(range(len(self)),key=self.counts.__getitem__)
+            self.__count_index = array(COUNT_TYPE,rows)
+
+        return self.__count_index
+
+    def count_range(self,low,high):
+        """
+            Returns:
+
+                (i,j) the range of positions, in count_index, of the rows
+                with a count from low to high (excluded)
+        """
+        counts = _PermutedColumn(self.counts,self.count_index())
+
+        i = bisect_left(counts,low)
+        j = bisect_left(counts,high,i)
+
+        return i, max(i,j)
+
+    def nbytes(self):
+        nbytes = sum(column.itemsize*len(column) for column in self.columns) + \
+            self.counts.itemsize*len(self.counts)
+
+        if isinstance(self.counts,QuantizedColumn):
+            nbytes += self.counts.codebook.itemsize*len(self.counts.codebook)
+
+        return nbytes
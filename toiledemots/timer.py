@@ -5,6 +5,10 @@ def seconds_to_string(seconds):
     return str(datetime.timedelta(seconds=seconds)).split('.')[0]
 
 class Timer(object):
+    """
+        Estimates the remaining time of op_todo operations on the wall clock,
+        see Metrics.progress which replaces it in the package
+    """
     def __init__(self,op_todo=None,update_freq=5,out=None):
         self.op_todo = op_todo
         self.start_time = None
@@ -13,8 +17,8 @@ class Timer(object):
         self.out = out
 
     def start(self):
-        self.start_time = time.clock()
-        self.update_time = time.clock()
+        self.start_time = time.time()
+        self.update_time = time.time()
 
     def reset_op_todo(self,op_todo):
         self.op_todo = op_todo
@@ -25,10 +29,13 @@ class Timer(object):
 
         self.op_done += op_done
 
-        if time.clock() - self.update_time > 120:
-            self.update_time = time.clock()
+        if self.op_todo is None:
+            return None
 
-            return (time.clock()-self.start_time)/(0.+self.op_done)*(self.op_todo-self.op_done)
+        if time.time() - self.update_time > 120:
+            self.update_time = time.time()
+
+            return (time.time()-self.start_time)/(0.+self.op_done)*(self.op_todo-self.op_done)
         
         return None
 
@@ -37,10 +44,10 @@ class Timer(object):
         if update and self.out:
             self.out.write("time remaining : "+seconds_to_string(update)+"\n")
         elif update:
-            print "time remaining : "+seconds_to_string(update)+"\n"
+            print("time remaining : "+seconds_to_string(update)+"\n")
 
     def over(self):
         if self.start_time==None:
             raise BaseException("Need to start the timer before ending it")
 
-        return time.clock()-self.start_time
+        return time.time()-self.start_time
@@ -1,57 +1,341 @@
 from collections import defaultdict
-from ngrams import nGrams
-import Levenshtein
+from .ngrams import nGrams
+from .metrics import Metrics, get_metrics
+from .vocabulary import Vocabulary
+from .table import COUNT_TYPE
 import gc
+import heapq
+import itertools
+import marshal
+from array import array
 
 voyelles = ["a", "e", "i", "o", "u", "y"]
 
-def distance(string1, string2):
+# maximal difference of length between a word and its candidates
+LENGTH_BAND = 2
+
+MAGIC = "TDMTOILE"
+VERSION = 1
+
+# number of words queried by a worker at once in get_closests_many
+CHUNK_WORDS = 100
+
+# the Toile queried by the workers of get_closests_many, set by the
+# initializer of their pool (see Toile.pool)
+_shared_toile = None
+
+def _aligned_points(string1, string2):
+    """
+        Points of two strings of the same length: 1 for every substring
+        common to both at the same position, 2 if it is made of vowels only
+
+        The substrings ending at a matching position are the suffixes of the
+        current run of matching letters, the vowel ones the suffixes of its
+        current run of vowels, which makes it linear in the length.
+    """
     points = 0
+    run, vowels = 0, 0
 
-    if len(string1) < len(string2):
-        return max(distance(" "+string1, string2), distance(string1+" ", string2))
-    elif len(string1) > len(string2):
-        return max(distance(string1, " "+string2), distance(string1, string2+" "))
-
-    for i in range(len(string1)+1):
-        for j in xrange(i+1, len(string1)+1):
-#            print string1[i:j], string2[i:j]
-            if string1[i:j] == string2[i:j]:
-                if all(letter in voyelles for letter in string1[i:j]):
-                    points += 2
-                else:
-                    points += 1
+    for letter1, letter2 in zip(string1, string2):
+        if letter1 == letter2:
+            run += 1
+            if letter1 in voyelles:
+                vowels += 1
+            else:
+                vowels = 0
+            points += run + vowels
+        else:
+            run, vowels = 0, 0
 
     return points
 
+def _paddings(string, length):
+    """
+        Returns string padded with spaces to length in every way, from all
+        the spaces after it to all the spaces before it
+    """
+    d = length - len(string)
+    return [" "*k + string + " "*(d-k) for k in range(d+1)]
+
+def distance(string1, string2):
+    """
+        Arguments:
+
+            string1, string2: the words to compare
+
+        Returns:
+
+            the similarity of the words, the number of common substrings at
+            the same position (twice for the ones made of vowels only). The
+            shortest word is padded with spaces to the length of the other in
+            the way giving the most points.
+
+        Examples:
+
+            distance("bonjour", "honneur")
+    """
+    if len(string1) < len(string2):
+        string1, string2 = string2, string1
+
+    return max(_aligned_points(string1, padded)
+               for padded in _paddings(string2, len(string1)))
+
+def distances(word, candidats):
+    """
+        Arguments:
+
+            word: the word to compare
+            candidats: a list of words
+
+        Returns:
+
+            the list of the distances between word and every candidat, the
+            paddings of word being computed once per length
+    """
+    paddings = {}
+    scores = []
+
+    for candidat in candidats:
+        if len(candidat) > len(word):
+            if len(candidat) not in paddings:
+                paddings[len(candidat)] = _paddings(word, len(candidat))
+            scores.append(max(_aligned_points(candidat, padded)
+                              for padded in paddings[len(candidat)]))
+        else:
+            scores.append(distance(word, candidat))
+
+    return scores
+
+def _letters_bound(word):
+    """
+        Returns the most points (see distance) a word sharing no aligned
+        bigram of characters with word can get: its matching letters are
+        never next to each other, so each gives 1 point, 2 if it is a vowel
+    """
+    return sum(2 if letter in voyelles else 1 for letter in word)
+
+def _share_toile(toile):
+    """
+        Initializer of the forked workers, which share the words of toile
+    """
+    global _shared_toile
+    _shared_toile = toile
+
+def _load_toile(file):
+    """
+        Initializer of the spawned workers, which load the toile saved in file
+    """
+    global _shared_toile
+    _shared_toile = Toile(metrics=Metrics())
+    _shared_toile.load(file)
+
+def _closests_chunk(args):
+    """
+        get_closests of a chunk of words in a worker process
+    """
+    words, options = args
+
+    return [_shared_toile.get_closests(word, **options) for word in words]
+
+def _edit_distance(string1, string2, max_dist):
+    """
+        Levenshtein distance of the strings, computed only on the diagonals
+        at most max_dist away from the main one. Returns max_dist+1 as soon
+        as the distance is known to be larger than max_dist.
+    """
+    outside = max_dist + 1
+
+    if abs(len(string1) - len(string2)) > max_dist:
+        return outside
+
+    previous = list(range(len(string2)+1))
+    for i in range(1, len(string1)+1):
+        lo = max(1, i-max_dist)
+        hi = min(len(string2), i+max_dist)
+
+        current = [outside]*(len(string2)+1)
+        if i <= max_dist:
+            current[0] = i
+
+        for j in range(lo, hi+1):
+            current[j] = min(previous[j-1] + (string1[i-1] != string2[j-1]),
+                             previous[j] + 1,
+                             current[j-1] + 1)
+
+        if min(current[lo-1:hi+1]) > max_dist:
+            return outside
+
+        previous = current
+
+    return min(previous[len(string2)], outside)
+
 class Toile(set):
     """
     .. todo:: 
 
         WRITEME
+
+    The words are kept in buckets of their length and indexed on their
+    bigrams of characters. The counts of every word read are kept as well
+    (an array indexed by a Vocabulary), so that update adds the words
+    reaching min_count with new lines and get_closests can rank by frequency.
+
+    update, save and load are timed as the phases toile.update, toile.save and
+    toile.load of metrics (default metrics.get_metrics()), the searches and
+    the words they score are counted as toile.closests and toile.candidates.
+
+    Examples:
+
+        toile = Toile(min_count=0)
+        toile.build(pipe.fetch_text_lines("data/train.fr"))
+        toile.save("toile.bin")
+
+        toile = Toile()
+        toile.load("toile.bin")
+        toile.update([u"Une nouvelle phrase"])
     """
     
-    def __init__(self, min_count=10):
+    def __init__(self, min_count=10, tokenizer=None, metrics=None):
         self.__toile = defaultdict(set)
+        # (bigram of characters, position) -> words
+        self.__bigrams = defaultdict(set)
+        self.__vocabulary = Vocabulary()
+        self.__counts = array(COUNT_TYPE)
         self.min_count = min_count
+        self.tokenizer = tokenizer
+        self.metrics = metrics if metrics is not None else get_metrics()
 
     def build(self, lines):
+        self.update(lines, del_lines=True)
+
+    def update(self, lines, del_lines=False):
+        """
+            Arguments:
+
+                lines: the new lines, any iterable of unicode lines
+                del_lines: empty the list of lines once it is read (default False)
 
-        ngrams = nGrams(1)
-        ngrams.build(lines, del_lines=True)
+            Counts the words of lines and adds the ones whose total count,
+            with the lines already read, is over min_count
+        """
+        with self.metrics.phase("toile.update"):
+            self.__update(lines, del_lines)
+
+    def __update(self, lines, del_lines):
+        ngrams = nGrams(1, metrics=self.metrics)
+        ngrams.build(lines, del_lines=del_lines, tokenizer=self.tokenizer)
 
         lines = None
         gc.collect()
 
-        for ngram in ngrams.getgrams(1):
-            if ngrams[ngram] > self.min_count:
-                self.add(ngram[0])
+        vocabulary = ngrams.get_vocabulary()
+        table = ngrams.table(1)
+        for row in range(len(table)):
+            word = vocabulary.word(table.columns[0][row])
+
+            id = self.__vocabulary.add(word)
+            if id == len(self.__counts):
+                self.__counts.append(0)
+            self.__counts[id] += table.counts[row]
 
-            del ngrams[ngram]
+            if self.__counts[id] > self.min_count:
+                self.add(word)
 
         ngrams = None
         gc.collect()
 
+    def save(self, file):
+        """
+            Arguments:
+
+                file: where to save
+
+            Saves the words by length, the bigram index (as positions in the
+            words) and the counts, marshalled in a single record
+
+            Examples:
+
+                toile.save("toile.bin")
+        """
+        with self.metrics.phase("toile.save"):
+            self.__save(file)
+
+    def __save(self, file):
+        words = []
+        for length in sorted(self.__toile):
+            words.extend(sorted(self.__toile[length]))
+
+        numbers = dict((word, i) for i, word in enumerate(words))
+
+        index = {}
+        for key, bigram_words in self.__bigrams.items():
+            index[key] = array('i', sorted(numbers[word] for word in bigram_words)).tobytes()
+
+        file = open(file, 'wb')
+        marshal.dump((MAGIC, VERSION, self.min_count, words, index,
+                      self.__vocabulary.words(), self.__counts.tobytes()), file)
+        file.close()
+
+    def load(self, file):
+        """
+            Arguments:
+
+                file: a file saved by Toile.save
+
+            Replaces the words, the index, the counts and min_count by the
+            saved ones
+
+            Examples:
+
+                toile.load("toile.bin")
+        """
+        with self.metrics.phase("toile.load"):
+            self.__load(file)
+
+    def __load(self, file):
+        file = open(file, 'rb')
+        try:
+            record = marshal.load(file)
+        except (EOFError, ValueError, TypeError):
+            raise ValueError("not a saved Toile")
+        finally:
+            file.close()
+
+        if not isinstance(record, tuple) or record[0] != MAGIC:
+            raise ValueError("not a saved Toile")
+        if record[1] != VERSION:
+            raise ValueError("unsupported Toile version %i" % record[1])
+
+        magic, version, self.min_count, words, index, counted, saved = record
+        counts = array(COUNT_TYPE)
+        counts.frombytes(saved)
+
+        self.__toile = defaultdict(set)
+        for word in words:
+            self.__toile[len(word)].add(word)
+
+        self.__bigrams = defaultdict(set)
+        for key, saved in index.items():
+            numbers = array('i')
+            numbers.frombytes(saved)
+            self.__bigrams[key] = set(words[i] for i in numbers)
+
+        self.__vocabulary = Vocabulary(counted)
+        self.__counts = counts
+
+    def count(self, word):
+        """
+            Returns:
+
+                the number of times word was read, 0 if it never was
+        """
+        id = self.__vocabulary.get(word)
+
+        if id is None:
+            return 0
+
+        return self.__counts[id]
+
     def __getitem__(self, key):
         return self.__toile[key]
 
@@ -59,27 +343,261 @@ class Toile(set):
         if word not in self.__toile[len(word)]:
             self.__toile[len(word)].add(word)
 
-    def get_closests(self, word, max_dist=4):
+            for i in range(len(word)-1):
+                self.__bigrams[(word[i:i+2], i)].add(word)
+
+    def __band(self, word):
+        """
+            Returns every word with a length within LENGTH_BAND of word
+        """
         candidats = []
+        for length in range(len(word)-LENGTH_BAND, len(word)+LENGTH_BAND+1):
+            candidats.extend(self.__toile.get(length, ()))
+
+        return candidats
+
+    def __shared_bigrams(self, word, shift, padded=False):
+        """
+            Returns the number of bigrams of word every word shares with it,
+            at positions distant of shift or less. If padded, only at the
+            shifts distance can align the words on: the shortest word is
+            shifted to the right of 0 to the difference of their lengths.
+        """
+        shared = defaultdict(int)
+        for i in range(len(word)-1):
+            bigram = word[i:i+2]
+
+            candidats = set()
+            for j in range(max(0, i-shift), i+shift+1):
+                words = self.__bigrams.get((bigram, j), ())
+                if not padded or j == i:
+                    candidats.update(words)
+                    continue
+
+                for candidat in words:
+                    d = len(candidat) - len(word)
+                    if 0 < j-i <= d or d <= j-i < 0:
+                        candidats.add(candidat)
+
+            for candidat in candidats:
+                shared[candidat] += 1
+
+        return shared
+
+    def __candidates(self, word):
+        """
+            Returns the words of the length band of word sharing at least one
+            bigram of characters with it at a shift distance aligns the words
+            on, the ones sharing the most first. The other words of the band
+            get at most _letters_bound(word) points.
+        """
+        shared = self.__shared_bigrams(word, LENGTH_BAND, padded=True)
+
+        candidats = [candidat for candidat in shared
+                     if abs(len(candidat)-len(word)) <= LENGTH_BAND]
+
+        return sorted(candidats, key=lambda candidat: (-shared[candidat], candidat))
+
+    def __within(self, word, max_dist):
+        """
+            Returns the words of the length band of word at an edit distance
+            of max_dist or less, the ones sharing the most bigrams first
+
+            With max_dist edits, at least len(word)-1-2*max_dist bigrams of
+            word are kept, shifted of max_dist positions or less: only the
+            words sharing that many bigrams are checked.
+        """
+        band = min(max_dist, LENGTH_BAND)
+        threshold = len(word) - 1 - 2*max_dist
+
+        if threshold > 0:
+            shared = self.__shared_bigrams(word, max_dist)
+            candidats = [candidat for candidat, n in shared.items()
+                         if n >= threshold and abs(len(candidat)-len(word)) <= band]
+            candidats.sort(key=lambda candidat: (-shared[candidat], candidat))
+        else:
+            candidats = [candidat for candidat in self.__band(word)
+                         if abs(len(candidat)-len(word)) <= band]
+
+        return [candidat for candidat in candidats
+                if _edit_distance(word, candidat, max_dist) <= max_dist]
+
+    def get_closests(self, word, k=None, max_dist=None, min_score=None, by_frequency=False):
+        """
+            Arguments:
+
+                word: the word to search
+                k: the number of words to return (default None, every word of the
+                    length band of word)
+                max_dist: the maximal edit distance (Levenshtein) of the words
+                    (default None, no maximum)
+                min_score: the minimal score of the words (default None). With k,
+                    the search stops at the first k words reaching it.
+                by_frequency: rank the words of equal score from the most frequent
+                    (default False, from the last in alphabetical order)
+
+            Returns:
+
+                a list of (score, word) sorted from the closest word
+
+            When k is given, the words sharing an aligned bigram of
+            characters with word are scored first. The rest of the length band,
+            whose words get at most _letters_bound(word) points, is scanned
+            only if the k-th best score is not above this bound, so the result
+            is the one of a scan of the whole band. With min_score, the words
+            are scored from the ones sharing the most bigrams with word, so
+            the first k reaching min_score are usually the best, the rest of
+            the band being scanned only if min_score is within the bound.
+            When max_dist is given, only the words within max_dist edits are
+            scored, whatever k.
+
+            Examples:
+
+                toile.get_closests(u"ciel", 20)
+                toile.get_closests(u"ciel", 20, max_dist=2, by_frequency=True)
+        """
+        key = None
+        if by_frequency:
+            key = lambda item: (item[0], self.count(item[1]), item[1])
+
+        self.metrics.count("toile.closests")
+
+        if max_dist is not None:
+            candidats = self.__within(word, max_dist)
+        elif k is None:
+            candidats = self.__band(word)
+        else:
+            candidats = self.__candidates(word)
+
+            if min_score is None:
+                scores = list(zip(distances(word, candidats), candidats))
+                closests = heapq.nlargest(k, scores, key=key)
+
+                if len(closests) == k and closests[-1][0] > _letters_bound(word):
+                    self.metrics.count("toile.candidates", len(candidats))
+                    return closests
+
+                # a word of the rest of the band may be in the k closests
+                rest = self.__rest(word, candidats)
+                self.metrics.count("toile.candidates", len(candidats)+len(rest))
+                scores.extend(zip(distances(word, rest), rest))
+
+                return heapq.nlargest(k, scores, key=key)
+
+            if min_score <= _letters_bound(word):
+                candidats = candidats + self.__rest(word, candidats)
+
+        if min_score is None:
+            scores = zip(distances(word, candidats), candidats)
+        else:
+            scores = ((distance(word, candidat), candidat) for candidat in candidats)
+            scores = ((score, candidat) for score, candidat in scores if score >= min_score)
+            if k is not None:
+                scores = list(itertools.islice(scores, k))
+
+        self.metrics.count("toile.candidates", len(candidats))
+
+        if k is None:
+            return sorted(scores, key=key, reverse=True)
+
+        return heapq.nlargest(k, scores, key=key)
+
+    def __rest(self, word, candidats):
+        """
+            Returns the words of the length band of word which are not in candidats
+        """
+        candidats = set(candidats)
+
+        return [candidat for candidat in self.__band(word) if candidat not in candidats]
+
+    def pool(self, workers):
+        """
+            Arguments:
+
+                workers: the number of processes
+
+            Returns:
+
+                a multiprocessing Pool of workers searching the words of this
+                toile, to give to get_closests_many and to terminate once done
+
+            Where processes can be forked (POSIX), the workers are forked
+            whatever the default start method and read the buckets and the
+            index of this process directly. Elsewhere (Windows), the toile is
+            saved in a temporary file every worker loads, removed with the pool.
+
+            Examples:
+
+                pool = toile.pool(8)
+                toile.get_closests_many([u"ciel", u"maison"], 20, pool=pool)
+                pool.terminate()
+        """
+        import multiprocessing
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context("fork").Pool(workers, _share_toile, (self,))
+
+        import os
+        import tempfile
+        import weakref
+
+        descriptor, file = tempfile.mkstemp(prefix="toile-")
+        os.close(descriptor)
+        self.save(file)
+
+        pool = multiprocessing.Pool(workers, _load_toile, (file,))
+        weakref.finalize(pool, os.remove, file)
+
+        return pool
+
+    def get_closests_many(self, words, k=None, workers=None, pool=None, **options):
+        """
+            Arguments:
+
+                words: the words to search, any iterable
+                k: the number of words to return for every word (default None, see get_closests)
+                workers: the number of processes searching chunks of words in parallel
+                    (default None, the words are searched in this process)
+                pool: a Pool of this toile (see pool) searching the words, kept
+                    open for the next calls (default None, a pool of workers
+                    is created for this call if workers is given)
+                options: max_dist, min_score and by_frequency, see get_closests
+
+            Returns:
 
-        for length in xrange(len(word)-2, len(word)+3):
-            for candidat in self[length]:
-                    
-#                dist = Levenshtein.distance(word, candidat)
-                dist = distance(word, candidat)
+                the list of the results of get_closests for every word, in the
+                order of words
 
-        #            if dist <= max_dist:
-                candidats.append((dist, candidat))
+            Only the words and the results are sent to the workers.
 
-        return sorted(candidats, reverse=True)
+            Examples:
 
+                toile.get_closests_many([u"ciel", u"maison"], 20, workers=8)
+        """
+        words = list(words)
 
+        if pool is None and (not workers or workers <= 1):
+            return [self.get_closests(word, k, **options) for word in words]
 
+        options['k'] = k
+        chunks = [(words[i:i+CHUNK_WORDS], options)
+                  for i in range(0, len(words), CHUNK_WORDS)]
 
+        if pool is not None:
+            results = pool.map(_closests_chunk, chunks)
+        else:
+            pool = self.pool(workers)
+            try:
+                results = pool.map(_closests_chunk, chunks)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
 
+        return [closests for chunk in results for closests in chunk]
 
 
 
 
 if __name__ == "__main__":
-    distance("bonjour", "honneur")
+    print(distance("bonjour", "honneur"))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import re
+from array import array
+
+__all__ = ['Tokenizer', 'CLEAN_STR']
+
+# the special characters replaced by spaces by default
+CLEAN_STR = r"""[!"%&'\(\)\+,‚‘’\.\/:;=?\[\]«»¡£§²´µ·¸º°…“”•„−–—]"""
+
+def _character_class(pattern):
+    r"""
+        Returns the set of characters matched by a regular expression
+        made of a single character class (ex: u"[!?\.]"), or None if
+        the pattern is anything more complex
+    """
+
+    if len(pattern) < 3 or pattern[0] != u"[" or pattern[-1] != u"]" or pattern[1] == u"^":
+        return None
+
+    characters = set()
+    escaped = False
+
+    for character in pattern[1:-1]:
+        if escaped:
+            # \s, \w, \d, ... are not single characters
+            if character.isalnum():
+                return None
+            characters.add(character)
+            escaped = False
+        elif character == u"\\":
+            escaped = True
+        elif character in u"[]-^":
+            return None
+        else:
+            characters.add(character)
+
+    if escaped:
+        return None
+
+    return characters
+
+class Tokenizer(object):
+    """
+        Tokenizer
+
+        Arguments:
+
+            clean_str: a regular expression of what is replaced by spaces
+                (default removes every special characters, None to keep everything)
+            lower: lower case the lines (default True)
+
+        Splits lines in words the way nGrams.build does: the line is lower cased,
+        cleaned with clean_str and split on spaces. When clean_str is a single
+        character class, it is applied with unicode.translate instead of re.sub
+        and a batch of lines is lower cased and cleaned in a single call.
+
+        Examples:
+
+            tokenizer = Tokenizer()
+            tokenizer.tokenize(u"C'est un test bien simple")
+            tokenizer.tokenize_batch([u"C'est un test",u"bien simple"])
+            tokenizer.encode_batch([u"C'est un test",u"bien simple"],vocabulary)
+    """
+
+    def __init__(self,clean_str=CLEAN_STR,lower=True):
+        self.clean_str = clean_str
+        self.lower = lower
+
+        self.__table = None
+        self.__regex = None
+
+        if clean_str:
+            characters = _character_class(clean_str)
+
+            if characters is not None:
+                self.__table = dict((ord(character),u" ") for character in characters)
+            else:
+                self.__regex = re.compile(clean_str)
+
+    def clean(self,line):
+        """
+            Arguments:
+
+                line: a unicode line
+
+            Returns:
+
+                the line lower cased, without its end of line and cleaned
+        """
+
+        if self.lower:
+            line = line.lower()
+
+        line = line.strip(u"\n")
+
+        if self.__table is not None:
+            return line.translate(self.__table)
+        elif self.__regex is not None:
+            return self.__regex.sub(u" ",line)
+
+        return line
+
+    def tokenize(self,line):
+        """
+            Arguments:
+
+                line: a unicode line
+
+            Returns:
+
+                the list of words of the line
+        """
+
+        return [word for word in self.clean(line).split(u" ") if word]
+
+    def tokenize_batch(self,lines):
+        """
+            Arguments:
+
+                lines: a list of unicode lines
+
+            Returns:
+
+                the list of words of every line
+        """
+
+        if self.__regex is None and lines:
+            lines = [line.strip(u"\n") for line in lines]
+            block = u"\n".join(lines)
+
+            # lines with an inner end of line can't be split back
+            if block.count(u"\n") == len(lines)-1 and ord(u"\n") not in (self.__table or {}):
+                if self.lower:
+                    block = block.lower()
+
+                if self.__table is not None:
+                    block = block.translate(self.__table)
+
+                return [[word for word in line.split(u" ") if word] for line in block.split(u"\n")]
+
+        return [self.tokenize(line) for line in lines]
+
+    def encode(self,line,vocabulary):
+        """
+            Arguments:
+
+                line: a unicode line
+                vocabulary: the Vocabulary interning the words
+
+            Returns:
+
+                an array of the word ids of the line
+        """
+
+        return array('i',map(vocabulary.add,self.tokenize(line)))
+
+    def encode_batch(self,lines,vocabulary):
+        """
+            Arguments:
+
+                lines: a list of unicode lines
+                vocabulary: the Vocabulary interning the words
+
+            Returns:
+
+                a list with an array of word ids for every line
+        """
+
+        add = vocabulary.add
+        return [array('i',map(add,words)) for words in self.tokenize_batch(lines)]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+__all__ = ['Vocabulary']
+
+class Vocabulary(object):
+    """
+        Word vocabulary
+
+        Arguments:
+
+            words: words to add to the vocabulary (default empty)
+
+        Interns every word to an integer id. The ids are given in insertion
+        order; sort() renumbers them so that the order of the ids follows
+        the order of the words. nGrams keeps its vocabulary sorted so that
+        comparing tuples of ids is the same as comparing tuples of words.
+
+        Examples:
+
+            vocabulary = Vocabulary([u"un",u"test"])
+            vocabulary.add(u"simple")
+            vocabulary[u"test"]
+            vocabulary.word(0)
+            vocabulary.encode((u"un",u"test"))
+            vocabulary.decode((0,1))
+    """
+
+    def __init__(self,words=()):
+        self.__ids = {}
+        self.__words = []
+
+        for word in words:
+            self.add(word)
+
+    def add(self,word):
+        """
+            Arguments:
+
+                word: the word to intern
+
+            Returns:
+
+                the id of the word (a new one if the word was not in the vocabulary)
+        """
+        id = self.__ids.get(word)
+
+        if id is None:
+            id = len(self.__words)
+            self.__ids[word] = id
+            self.__words.append(word)
+
+        return id
+
+    def get(self,word,ifnot=None):
+        return self.__ids.get(word,ifnot)
+
+    def __getitem__(self,word):
+        return self.__ids[word]
+
+    def __contains__(self,word):
+        return word in self.__ids
+
+    def __len__(self):
+        return len(self.__words)
+
+    def __iter__(self):
+        return iter(self.__words)
+
+    def word(self,id):
+        return self.__words[id]
+
+    def words(self):
+        """
+            Returns:
+
+                the list of words indexed by id
+        """
+        return self.__words
+
+    def encode(self,ngram):
+        """
+            Arguments:
+
+                ngram: a tuple of words
+
+            Returns:
+
+                the tuple of ids of the words, None if a word is not in
+                the vocabulary
+        """
+        try:
+            return tuple([self.__ids[word] for word in ngram])
+        except KeyError:
+            return None
+
+    def decode(self,ids):
+        """
+            Arguments:
+
+                ids: a sequence of word ids
+
+            Returns:
+
+                the tuple of words
+        """
+        return tuple([self.__words[id] for id in ids])
+
+    def sort(self):
+        """
+            Renumbers the ids so that they follow the order of the words
+
+            Returns:
+
+                an array mapping every old id to its new id
+        """
+        order = sorted(range(len(self.__words)),key=self.__words.__getitem__)
+
+        remap = array('i',[0])*len(order)
+        for new, old in enumerate(order):
+            remap[old] = new
+
+        self.__words = [self.__words[old] for old in order]
+        self.__ids = dict((word,id) for id, word in enumerate(self.__words))
+
+        return remap